@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# Measures how fast the fuzzing engine itself is: parsing plans, and cloning,
+#   mutating, rendering and executing sequences.  The plans are generated, and
+#   the target does nothing, so the numbers are the engine's own overhead.
+#   First, it checks that each executor gets through some awkward scripts.
+#
+# USAGE: benchmark_fuzzplan.py [--save baseline.json] [--compare baseline.json]
+import sys, os, time, random, shutil, tempfile, json, argparse, itertools, threading
+import fuzzplan
+
+# Each scenario below is (name, function that writes a plan of a given size, sizes)
+def manyBlocksPlan(n) :
+    # n distinct body blocks to choose from, each with one substitution point
+    return "##intparam nCommands 20\n\n" + "".join(": block%d @{numeric}\n\n" % i for i in range(n))
+
+def longSequencePlan(n) :
+    # a sequence of n body blocks
+    return "##intparam nCommands %d\n\n: a @{numeric}\n\n: b @{alphanumeric len=8}\n\n: c\n" % n
+
+def manySubstitutionsPlan(n) :
+    # n substitution points on a single command line
+    return "##intparam nCommands 20\n\n: " + " ".join("@{numeric}" for i in range(n)) + "\n"
+
+def deepExprPlan(n) :
+    # expr trees that have been grown by n mutations before measuring starts
+    return ("##intparam nCommands 1\n##floatparam fuzzProbMutateSubstitution 1.0\n" +
+            "##floatparam expr.mutProbTree 0.5\n##intparam warmupMutations %d\n\n: @{expr}\n" % n)
+
+scenarios = [
+    ("blocks", manyBlocksPlan, [10, 100, 1000]),
+    ("commands", longSequencePlan, [10, 100, 1000]),
+    ("subs", manySubstitutionsPlan, [10, 100, 1000]),
+    ("expr", deepExprPlan, [10, 100, 1000]),
+]
+
+# Scripts that have tripped up executors before, and the output value each one must still report.
+#   They are run together, so that a trial that outlives its output shares the executor with others.
+awkwardScripts = [("echo A:=1; exec >&-; sleep 0.5", "A"), # closes stdout and keeps running
+                  ("echo B:=1", "B"),
+                  ("sleep 1; echo C:=1", "C"),
+                  ("(sleep 0.3; echo LATE:=1) & echo D:=1", "D"), # leaves a child behind
+                  ("exec >/dev/null; sleep 0.3", "TRIAL_OUTCOME"),
+                  ("X=1\n" * 40000 + "echo E:=$X", "E")] # too long for a command line
+
+def checkExecutors(planPath) :
+    # Returns the names of the executors that lost or hung on a trial
+    failures = list()
+    for executor in ("popen", "shell", "event") :
+        plan = fuzzplan.Fuzzplan(planPath)
+        plan.parameters.update({"executor" : executor, "nWorkers" : 2, "trialTimeout" : 10.0})
+        results = list()
+        runner = threading.Thread(target=lambda : results.extend(plan.runScripts([script for script, key in awkwardScripts])))
+        runner.daemon = True
+        runner.start()
+        runner.join(30.0)
+        if runner.is_alive() or any(key not in result.outputValues for (script, key), result in zip(awkwardScripts, results)) :
+            failures.append(executor)
+        else : plan.close()
+    return failures
+
+def rate(function, minTime) :
+    # Call function repeatedly for at least minTime seconds; return calls per second
+    n = 0
+    start = time.time()
+    while True :
+        function()
+        n += 1
+        elapsed = time.time() - start
+        if elapsed >= minTime : return n / elapsed
+
+class Quiet(object) :
+    """This class swallows the trial output that Fuzzplan prints while a benchmark is running"""
+    def __enter__(self) :
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+    def __exit__(self, *args) :
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def benchmarkPlan(planPath, minTime) :
+    results = dict()
+    results["parse"] = rate(lambda : fuzzplan.Fuzzplan(planPath), minTime)
+    plan = fuzzplan.Fuzzplan(planPath)
+    sequence = fuzzplan.CommandSequence(plan)
+    labels = itertools.count() # every mutation gets its own label, and so its own RNG
+    for i in range(int(plan.parameters.get("warmupMutations", 0))) : sequence.mutateCommandSequence(next(labels))
+    sequence.render()
+    results["clone"] = rate(lambda : fuzzplan.CommandSequence(orig=sequence), minTime)
+    def mutate() :
+        fuzzplan.CommandSequence(orig=sequence).mutateCommandSequence(next(labels))
+    results["mutate"] = rate(mutate, minTime)
+    # Rendering is measured the way the fuzzing loop does it: a mutant of an already-rendered
+    #   sequence.  Making the mutants isn't counted.
+    nRendered = 0
+    renderTime = 0.0
+    wallStart = time.time()
+    # (Rendering is so much cheaper than mutating that the wall-clock time has to be capped too)
+    while renderTime < minTime and (nRendered == 0 or time.time() - wallStart < 4 * minTime) :
+        mutants = [fuzzplan.CommandSequence(orig=sequence) for i in range(100)]
+        for mutant in mutants : mutant.mutateCommandSequence(next(labels))
+        start = time.time()
+        for mutant in mutants : mutant.render()
+        renderTime += time.time() - start
+        nRendered += len(mutants)
+    results["render"] = nRendered / renderTime
+    # Execution is measured in batches, the way guided mode runs its mutants
+    batch = [fuzzplan.CommandSequence(orig=sequence) for i in range(plan.getIntParam("nMutants"))]
+    for mutant in batch : mutant.mutateCommandSequence(next(labels))
+    with Quiet() :
+        results["execute"] = len(batch) * rate(lambda : plan.executeAll(batch), minTime)
+    plan.close()
+    return results
+
+def main() :
+    parser = argparse.ArgumentParser(description="Benchmark the fuzzplan engine")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="compare the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower than the baseline counts as a regression (default 0.25)")
+    parser.add_argument("--time", type=float, default=0.5, help="seconds to spend on each measurement")
+    parser.add_argument("--seed", type=int, default=12345)
+    args = parser.parse_args()
+    baseline = None
+    if args.compare is not None :
+        with open(args.compare, "r") as baselineFile : baseline = json.load(baselineFile)
+    directory = tempfile.mkdtemp(prefix="fuzzplan_benchmark_")
+    allResults = dict()
+    regressions = list()
+    try :
+        checkPath = os.path.join(directory, "check.txt")
+        with open(checkPath, "w") as planFile : planFile.write("##intparam nCommands 1\n\n: check\n")
+        for executor in checkExecutors(checkPath) :
+            print "Executor %s lost or hung on one of the awkward scripts" % executor
+            regressions.append(executor + "/check")
+        print "%-16s %-8s %14s %14s" % ("plan", "op", "ops/s", "vs baseline")
+        for name, makePlan, sizes in scenarios :
+            for size in sizes :
+                planName = "%s-%d" % (name, size)
+                planPath = os.path.join(directory, planName + ".txt")
+                with open(planPath, "w") as planFile : planFile.write(makePlan(size))
+                # Reseed for every plan, so that each one sees the same mutations from run to run
+                #   (the plan's campaign seed is drawn from random)
+                random.seed("%d-%s" % (args.seed, planName))
+                results = benchmarkPlan(planPath, args.time)
+                for op in ("parse", "clone", "mutate", "render", "execute") :
+                    key = planName + "/" + op
+                    allResults[key] = results[op]
+                    comparison = ""
+                    if baseline is not None and key in baseline :
+                        ratio = results[op] / baseline[key]
+                        comparison = "%.2fx" % ratio
+                        if ratio < 1.0 - args.tolerance :
+                            comparison += " SLOWER"
+                            regressions.append(key)
+                    print "%-16s %-8s %14.1f %14s" % (planName, op, results[op], comparison)
+                sys.stdout.flush()
+    finally :
+        shutil.rmtree(directory)
+    if args.save is not None :
+        with open(args.save, "w") as baselineFile : json.dump(allResults, baselineFile, indent=1, sort_keys=True)
+    if len(regressions) > 0 :
+        print "%d regression(s) (failed checks, or more than %d%% slower): %s" % (
+            len(regressions), int(100 * args.tolerance), ", ".join(regressions))
+        sys.exit(1)
+
+if __name__=="__main__" : main()
@@ -1,86 +1,194 @@
-import random
+import random, os
+try :
+    import numpy # optional; used to generate batches of numbers faster
+except ImportError :
+    numpy = None
 
+# REMEMBER: make every random choice with params["rng"], the random.Random that the
+#   trial's mutation was given, rather than with the random module, so that the
+#   trial can be rebuilt from the campaign seed.
+# REMEMBER: params["state"] is shared with copies of the sequence, so
+#   don't modify the objects inside it in place; build new ones instead.
 # REMEMBER: parameters set by the user could come in as strings,
 #   so please convert them to the type that you expect.
+# One way to do that is to declare a dict named <head>_params that maps
+#   parameter names to types; those parameters are then converted once,
+#   when the plan is loaded.
+# A substitution type whose values don't depend on lastOutput or state can
+#   also define <head>_batch(params, n), returning a list of n new values.
+#   The engine then generates values in bulk and hands them out one at a time
+#   (but only in runs without a seed, since these values can't be rebuilt).
+# A substitution type can define <head>_simplest(params), returning its simplest
+#   value; minimize mode tries it in place of real values.  Otherwise "" is tried.
 
+alphanumeric_params = {"len" : int}
 def alphanumeric_random(params) :
     chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-    return "".join([random.choice(chars) for I in range(int(params["len"]))])
+    rng = params["rng"]
+    return "".join([rng.choice(chars) for I in range(params["len"])])
 
+# For alphanumeric_batch: random bytes below 248 (= 4 * 62) are mapped onto the 62
+#   characters by a translation table, and the rest are thrown away, so that every
+#   character is equally likely
+alphanumericTable = "".join("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"[i % 62]
+                            for i in range(256))
+alphanumericDiscard = "".join(chr(i) for i in range(248, 256))
+def alphanumeric_batch(params, n) :
+    length = params["len"]
+    needed = n * length
+    pieces = list()
+    have = 0
+    while have < needed :
+        # Ask for a little extra, since about 3% of the bytes get thrown away
+        piece = os.urandom(needed - have + (needed - have) // 16 + 16).translate(alphanumericTable, alphanumericDiscard)
+        pieces.append(piece)
+        have += len(piece)
+    data = "".join(pieces)
+    return [data[i*length:(i+1)*length] for i in range(n)]
+
+numeric_params = {"min" : int, "max" : int}
 def numeric_random(params) :
-    return str(random.randint(int(params["min"]),int(params["max"])))
+    return str(params["rng"].randint(params["min"],params["max"]))
+
+def numeric_simplest(params) :
+    return str(min(max(0, params["min"]), params["max"]))
 
+def numeric_batch(params, n) :
+    low, high = params["min"], params["max"]
+    if numpy is not None and -2**62 < low <= high < 2**62 :
+        return [str(v) for v in numpy.random.randint(low, high + 1, size=n).tolist()]
+    return [str(random.randint(low, high)) for i in range(n)]
+
+float_params = {"min" : float, "max" : float}
 def float_random(params) :
-    return str(random.uniform(float(params["min"]),float(params["max"])))
+    return str(params["rng"].uniform(params["min"],params["max"]))
+
+def float_simplest(params) :
+    return str(min(max(0.0, params["min"]), params["max"]))
 
-def weighted_choice(pairs) :
-    totalWeight = 0.0
-    for option, weight in pairs : 
-        totalWeight += weight
-    r = random.uniform(0.0, totalWeight)
-    runningWeight = 0.0
-    for option, weight in pairs : 
-        runningWeight += weight
-        if r <= runningWeight : return option
+def float_batch(params, n) :
+    low, high = params["min"], params["max"]
+    if numpy is not None :
+        return [str(v) for v in numpy.random.uniform(low, high, size=n).tolist()]
+    return [str(random.uniform(low, high)) for i in range(n)]
+
+class ExprNode(object) :
+    """This class is one node of an expr tree, which is never changed once it has been built"""
+    # A node with op >= 0 is an infix node (op indexes into binaryChars) with a left and
+    #   right child; a node with op == -1 is a leaf holding a Substitution.  weight is the
+    #   total weight of the node's subtree relative to the node itself (see ExprTree), and
+    #   text is its rendered text, once it has been rendered.
+    __slots__ = ("op", "left", "right", "leaf", "weight", "size", "text")
+    def __init__(self, op, left, right, leaf, weight, size, text=None) :
+        self.op, self.left, self.right, self.leaf = op, left, right, leaf
+        self.weight, self.size, self.text = weight, size, text
+
+class ExprTree(object) :
+    """This class is an expr tree whose changes build new trees that share every unchanged node"""
+    # A node at depth d is picked with weight childWeight**d.  Since nodes never change,
+    #   replacing a subtree only builds new copies of the nodes on the path from the root
+    #   down to it, and the new tree shares everything else (weights and rendered text
+    #   included) with the old one, which copies of the sequence may still be using.
+    __slots__ = ("root", "childWeight")
+    def __init__(self, childWeight, root=None) :
+        self.root = root
+        self.childWeight = childWeight
+    def newLeaf(self, sub) : return ExprNode(-1, None, None, sub, 1.0, 1)
+    def newInfix(self, op, left, right) :
+        return ExprNode(op, left, right, None, 1.0 + self.childWeight * (left.weight + right.weight), 1 + left.size + right.size)
+    def randomPath(self, rng) :
+        # Walk down from the root, choosing between a node and its two subtrees by weight.
+        #   Returns the nodes from the root down to the chosen one, and which way each step went.
+        u = rng.random() * self.root.weight
+        path = [self.root]
+        wentLeft = list()
+        while True :
+            n = path[-1]
+            if u < 1.0 or n.op < 0 : return path, wentLeft
+            u = (u - 1.0) / self.childWeight
+            if u < n.left.weight :
+                path.append(n.left)
+                wentLeft.append(True)
+            else :
+                u -= n.left.weight
+                path.append(n.right)
+                wentLeft.append(False)
+    def replaced(self, path, wentLeft, m) :
+        # A new tree with m where the last node of path was, copying just its ancestors
+        for n, left in zip(reversed(path[:-1]), reversed(wentLeft)) :
+            m = self.newInfix(n.op, m, n.right) if left else self.newInfix(n.op, n.left, m)
+        return ExprTree(self.childWeight, m)
+    def size(self) : return self.root.size
+    def render(self, n, left, right, binaries) :
+        if n.text is None :
+            if n.op < 0 : n.text = n.leaf.getOutput()
+            else :
+                n.text = (left + self.render(n.left, left, right, binaries) +
+                          " " + binaries[n.op] + " " +
+                          self.render(n.right, left, right, binaries) + right)
+        return n.text
+    def __getstate__(self) :
+        # Pickle the nodes as a flat list, children first, rather than letting pickle recurse
+        #   down a tree that may be deeper than its recursion limit.  Shared nodes are listed once.
+        nodes = list()
+        index = dict() # id(node) -> its place in nodes
+        stack = [(self.root, False)]
+        while len(stack) > 0 :
+            n, childrenDone = stack.pop()
+            if id(n) in index : continue
+            if n.op >= 0 and not childrenDone :
+                stack.extend(((n, True), (n.right, False), (n.left, False)))
+                continue
+            index[id(n)] = len(nodes)
+            if n.op < 0 : nodes.append((-1, -1, -1, n.leaf))
+            else : nodes.append((n.op, index[id(n.left)], index[id(n.right)], None))
+        return {"childWeight" : self.childWeight, "nodes" : nodes}
+    def __setstate__(self, state) :
+        self.childWeight = state["childWeight"]
+        built = list()
+        for op, left, right, leaf in state["nodes"] :
+            built.append(self.newLeaf(leaf) if op < 0 else self.newInfix(op, built[left], built[right]))
+        self.root = built[-1]
+
+def expr_simplest(params) :
+    # A single leaf of the first type
+    fuzzplan = params["fuzzplan"]
+    return fuzzplan.compileSubstitutionPoint(params["leaves"].split(";;")[0]).simplest(fuzzplan)
 
+expr_params = {"newProbLeaf" : float, "mutProbLeaf" : float, "mutProbTree" : float, "childWeight" : float}
 def expr_random(params) :
-    binaries = [C for C in params["binaryChars"]]
+    binaries = params["binaryChars"]
     leaves = params["leaves"].split(";;")
     state = params["state"]
     fuzzplan = params["fuzzplan"]
-    def new_leaf() :
-        newLeafType = random.choice(leaves)
-        return ["leaf",fuzzplan.makeSubstitutionFromString(newLeafType)]
-    def new_subtree() :
-        probLeaf = float(params["newProbLeaf"])
-        if random.random() < probLeaf : return new_leaf()
-        infix = random.choice(binaries)
-        return ["infix",new_subtree(),infix,new_subtree()]
-    def stringify(subtree) :
-        if subtree[0] == "leaf" :
-            return subtree[1].getOutput()
-        if subtree[0] == "infix" :
-            return (params["left"] + stringify(subtree[1]) + 
-                    " " + subtree[2] + " " + 
-                    stringify(subtree[3]) + params["right"])
-        return "???"
+    rng = params["rng"]
+    def new_leaf(tree) :
+        newLeafType = rng.choice(leaves)
+        return tree.newLeaf(fuzzplan.makeSubstitutionFromString(newLeafType, rng))
+    def new_subtree(tree) :
+        probLeaf = params["newProbLeaf"]
+        if rng.random() < probLeaf : return new_leaf(tree)
+        infix = rng.randrange(len(binaries))
+        left = new_subtree(tree)
+        return tree.newInfix(infix, left, new_subtree(tree))
     if "tree" not in state :
-        tree = new_subtree()
-        params["state"]["tree"] = tree
-        return stringify(tree)
-    def random_node(treeContainer) :
-        if len(treeContainer) != 1 : raise Exception("Bad treeContainer in expr_random :: random_node")
-        def collect_paths(subtree, path, collection, weight) :
-            collection.append((path,weight))
-            if subtree[0] == "leaf" : pass
-            if subtree[0] == "infix" :
-                collect_paths(subtree[1],path+[1],collection, weight*float(params["childWeight"]))
-                collect_paths(subtree[3],path+[3],collection, weight*float(params["childWeight"]))
-        weightedPaths = list()
-        collect_paths(tree,[0],weightedPaths, 1.0)
-        #for x,y in weightedPaths : print x,y
-        randomPath = weighted_choice(weightedPaths)
-        ORP = randomPath
-        parent = treeContainer
-        while len(randomPath) > 1 : 
-            parent = parent[randomPath[0]]
-            randomPath = randomPath[1:]
-        def get() : return parent[randomPath[0]]
-        def put(v) : 
-            parent[randomPath[0]] = v
-            #print "ORP=",ORP
-        return {"get":get,"put":put}
-    tree = params["state"]["tree"]
-    probLeaf = float(params["mutProbLeaf"])
-    probTree = float(params["mutProbTree"])
-    r = random.random()
-    treeContainer = [tree]
-    n = random_node(treeContainer)
-    if r < probLeaf :              n["put"](new_leaf())
-    elif r < probLeaf + probTree : n["put"](new_subtree())
+        tree = ExprTree(params["childWeight"])
+        tree.root = new_subtree(tree)
     else :
-        import copy
-        v = random_node([tree])
-        n["put"](copy.deepcopy(v["get"]()))
-    params["state"]["tree"] = treeContainer[0]
-    return stringify(tree)
+        # The old tree is shared with copies of this sequence, so build a new one from it
+        #   (which costs only the path down to the node that changes)
+        tree = state["tree"]
+        probLeaf = params["mutProbLeaf"]
+        probTree = params["mutProbTree"]
+        r = rng.random()
+        path, wentLeft = tree.randomPath(rng)
+        if r < probLeaf :              tree = tree.replaced(path, wentLeft, new_leaf(tree))
+        elif r < probLeaf + probTree : tree = tree.replaced(path, wentLeft, new_subtree(tree))
+        else :
+            # Copy a random subtree over this node (sharing it, since nodes never change);
+            #   copying the node onto itself would change nothing
+            vPath, vWentLeft = tree.randomPath(rng)
+            while vWentLeft == wentLeft and tree.size() > 1 : vPath, vWentLeft = tree.randomPath(rng)
+            tree = tree.replaced(path, wentLeft, vPath[-1])
+    params["state"]["tree"] = tree
+    return tree.render(tree.root, params["left"], params["right"], binaries)
@@ -0,0 +1,13 @@
+# An example target for python_harness.txt.  The harness calls handle() with each
+#   rendered command, such as "push 42" or "pop".  The harness is long-lived, so the
+#   stack persists from one trial to the next unless the plan's header resets it.
+stack = list()
+
+def handle(command) :
+    words = command.split()
+    if words[0] == "reset" : del stack[:]
+    elif words[0] == "push" : stack.append(int(words[1]))
+    elif words[0] == "pop" and len(stack) > 0 : stack.pop()
+    elif words[0] == "crash" and len(stack) > 3 : raise ValueError("stack too deep")
+    print "stack is %s" % stack
+    return {"OBJECTIVE" : len(stack)}
@@ -1,204 +1,1586 @@
 #!/usr/bin/python
-import re, sys, os, subprocess, random, shlex, tempfile, stat, copy
+import re, sys, os, subprocess, random, shlex, signal, binascii, Queue, select
+import collections, hashlib, json, time, math, contextlib, resource, socket, struct, threading, cPickle
+import zlib, mmap, marshal, cStringIO, traceback
+from multiprocessing.pool import ThreadPool
 import default_substitution_types
 import user_substitution_types
 
 subPointRegex = r"@\{([^}]+)\}"
 
-class Substitution :
+devnull = open(os.devnull, "w")
+
+class SubstitutionType :
+    """This class represents a resolved substitution head: its generator function and plan-wide defaults"""
+    def __init__(self, head, fuzzplan) :
+        # The generator is a function whose name is head + "_random" within the
+        #   user_substitution_types module, and, failing that, the default_substitution_types module.
+        function_name_rand = head + "_random"
+        if hasattr(user_substitution_types, function_name_rand) : module = user_substitution_types
+        elif hasattr(default_substitution_types, function_name_rand) : module = default_substitution_types
+        else : raise Exception("Unrecognized substitution point with head: " + head)
+        self.head = head
+        self.function = getattr(module, function_name_rand)
+        # Stateless types may also generate many values at once, with a function named head + "_batch"
+        self.batchFunction = getattr(module, head + "_batch", None)
+        # ...and may name its simplest value, for minimize mode, with a function named head + "_simplest"
+        self.simplestFunction = getattr(module, head + "_simplest", None)
+        # The module may also declare the type of each parameter, as a dict named head + "_params"
+        self.paramTypes = getattr(module, head + "_params", dict())
+        # Allow the user to set plan-wide default parameters, by adding a line
+        #   to their plan file such as "##intparam numeric.max 100".
+        # These plan-wide defaults can still be overridden at any substitution point
+        #   by writing something like "@{numeric max=200}"
+        self.defaults = dict()
+        for p in fuzzplan.parameters :
+            if p.startswith(head + ".") : self.defaults[p[len(head)+1:]] = fuzzplan.parameters[p]
+    def makeParamTable(self, specific_params) :
+        params = dict(self.defaults)
+        params.update(specific_params) # Bring in params from this substitution point specifically
+        for name, convert in self.paramTypes.items() :
+            if name in params : params[name] = convert(params[name])
+        return params
+
+class Substitution(object) :
     """This class represents an occurrence of a substitution point such as '@{alphanumeric}'"""
-    def __init__(self, head=None, specific_params=None, fuzzplan=None, orig=None) :
+    __slots__ = ("point", "fuzzplan", "state", "output")
+    def __init__(self, point=None, fuzzplan=None, orig=None, rng=None) :
         if orig is not None : # copy
-            self.head = orig.head
-            self.specific_params = copy.deepcopy(orig.specific_params)
+            self.point = orig.point
             self.fuzzplan = orig.fuzzplan
-            self.state = copy.deepcopy(orig.state)
+            # Copies share whatever is inside the state; mutation functions replace
+            #   those objects rather than modifying them in place (see default_substitution_types)
+            self.state = dict(orig.state)
             self.output = orig.output
-        elif head is not None and specific_params is not None and fuzzplan is not None : # new
-            self.head = head
-            self.specific_params = specific_params
+        elif point is not None and fuzzplan is not None and rng is not None : # new
+            self.point = point # a SubstitutionPoint that has been bound to its SubstitutionType
             self.fuzzplan = fuzzplan
             self.state = dict() # reserved for future use
             self.output = ""
-            self.mutate() # this sets self.output, among other things
-        else :
-            raise Exception("Please pass head,specific_params,fuzzplan  or  orig  to Substitution")
-    def mutate(self) :
-        # This method calls a function whose name is self.head + "_random" within the
-        #   user_substitution_types module, and, failing that, the default_substitution_types module.
-        function_name_rand = self.head + "_random"
-        if not hasattr(user_substitution_types, function_name_rand) :
-            if not hasattr(default_substitution_types, function_name_rand) :
-                raise Exception("Unrecognized substitution point with head: " + self.head)
-            function = getattr(default_substitution_types, function_name_rand)
+            self.mutate(rng) # this sets self.output, among other things
         else :
-            function = getattr(user_substitution_types, function_name_rand)
-        params = dict()
-        # Allow the user to set plan-wide default parameters, by adding a line
-        #   to their plan file such as "##intparam numeric.max 100".
-        # These plan-wide defaults can still be overridden at any substitution point
-        #   by writing something like "@{numeric max=200}"
-        for p in self.fuzzplan.parameters :
-            # Look for and apply any such plan-wide defaults that have been set:
-            if p.startswith(self.head + ".") : params[p[len(self.head)+1:]] = self.fuzzplan.parameters[p]
-        params.update(self.specific_params) # Bring in params from this substitution point specifically 
+            raise Exception("Please pass point,fuzzplan,rng  or  orig  to Substitution")
+    def mutate(self, rng) :
+        # rng is the random.Random that this trial's mutation makes all of its choices with
+        if self.point.pool is not None :
+            # This type's values don't depend on the last output or state, so take one
+            #   that was generated ahead of time
+            self.output = self.point.pool.draw()
+            return
+        # The point's parameter table already merges the plan-wide defaults with the
+        #   parameters given at this substitution point, converted to the right types
+        params = dict(self.point.table)
         params["fuzzplan"] = self.fuzzplan
         params["lastOutput"] = self.output 
         params["state"] = self.state # Make self.state visible to the mutation function
-        self.output = function(params)
+        params["rng"] = rng
+        self.output = self.point.function(params)
         self.state = params["state"] # Allow mutation function to change self.state
     def getOutput(self) : return self.output
     def setOutput(self, output) : self.output = output
     def setState(self, state) : self.state = state
 
-def newSubstitutionFromMatch(match, fuzzplan) :
-    # If the substitution point is "@{numeric min=0 max=100}", then the
-    #  label is "numeric min=0 max=100"
-    #  head is "numeric"
-    #  kvp is "min=0 max=100"
-    label = match.group(1)
-    if " " in label :
-        head = label[:label.index(" ")]
-        kvp = label[label.index(" ")+1:]                
-        # https://stackoverflow.com/questions/4764547/creating-dictionary-from-space-separated-key-value-string-in-python
-        params = dict(token.split('=') for token in shlex.split(kvp))
-        return Substitution(head, params, fuzzplan)
-    else :
-        # no parameters
-        head = label.strip()
-        params = dict() # the user supplied no parameters at this substitution point
-        return Substitution(head, params, fuzzplan)
+class ValuePool(object) :
+    """This class hands out values for one substitution point, generating them in batches"""
+    __slots__ = ("batchFunction", "params", "size", "values")
+    def __init__(self, batchFunction, params, size) :
+        self.batchFunction = batchFunction
+        self.params = params
+        self.size = size
+        self.values = list()
+    def draw(self) :
+        if len(self.values) == 0 : self.values = self.batchFunction(self.params, self.size)
+        return self.values.pop()
+
+class SubstitutionPoint(object) :
+    """This class represents a parsed substitution point, such as '@{numeric min=0 max=100}', within a template"""
+    __slots__ = ("head", "params", "function", "table", "pool", "simplestFunction")
+    def __init__(self, label) :
+        # If the substitution point is "@{numeric min=0 max=100}", then the
+        #  label is "numeric min=0 max=100"
+        #  head is "numeric"
+        #  kvp is "min=0 max=100"
+        if " " in label :
+            self.head = label[:label.index(" ")]
+            kvp = label[label.index(" ")+1:]
+            # https://stackoverflow.com/questions/4764547/creating-dictionary-from-space-separated-key-value-string-in-python
+            self.params = dict(token.split('=') for token in shlex.split(kvp))
+        else :
+            # no parameters
+            self.head = label.strip()
+            self.params = dict() # the user supplied no parameters at this substitution point
+        self.function = None # these are filled in by bind()
+        self.table = None
+        self.pool = None
+        self.simplestFunction = None
+    def __deepcopy__(self, memo) : return self # points are shared by every copy of a sequence
+    def simplest(self, fuzzplan) :
+        # The simplest value this point can take, which minimize mode tries in place of the real one
+        if self.simplestFunction is None : return ""
+        params = dict(self.table)
+        params["fuzzplan"] = fuzzplan
+        return self.simplestFunction(params)
+    def bind(self, fuzzplan) :
+        # Look up the generator for this head, and work out the full table of parameters
+        #   it will be called with.  Unknown heads are reported here, when the plan is loaded.
+        substitutionType = fuzzplan.getSubstitutionType(self.head)
+        self.function = substitutionType.function
+        self.table = substitutionType.makeParamTable(self.params)
+        self.simplestFunction = substitutionType.simplestFunction
+        # Pooled values aren't drawn from the trial's RNG, so pools are only used when the
+        #   plan hasn't asked for reproducible trials by setting a seed
+        poolSize = fuzzplan.getIntParam("valuePoolSize")
+        if substitutionType.batchFunction is not None and poolSize > 0 and not fuzzplan.isSeeded() :
+            batchParams = dict(self.table)
+            batchParams["fuzzplan"] = fuzzplan
+            self.pool = ValuePool(substitutionType.batchFunction, batchParams, poolSize)
+        # Parameters can themselves contain substitution points (e.g. expr.leaves), so bind those too
+        for value in self.table.values() :
+            if isinstance(value, basestring) :
+                for match in re.finditer(subPointRegex, value) :
+                    fuzzplan.compileSubstitutionPoint(match.group(0))
+
+class CompiledTemplate(object) :
+    """This class represents a line of the plan file, split once into literal text and substitution points"""
+    __slots__ = ("string", "segments", "slots", "points")
+    def __init__(self, string) :
+        string = intern(string) # identical lines across the plan share one string
+        segments = list() # literal strings, with a placeholder wherever a substitution goes
+        slots = list() # (index into segments, index of substitution point) pairs
+        points = list()
+        lastIndex = 0
+        # This regular expression matches things like @{alphanumeric} or @{numeric}
+        for match in re.finditer(subPointRegex, string) :
+            segments.append(intern(string[lastIndex:match.start()]))
+            slots.append( (len(segments), len(points)) )
+            segments.append(None)
+            points.append(SubstitutionPoint(match.group(1)))
+            lastIndex = match.end()
+        segments.append(intern(string[lastIndex:]))
+        self.string = string
+        self.segments = tuple(segments)
+        self.slots = tuple(slots)
+        self.points = tuple(points)
+    def render(self, subs) :
+        # Fill in the output of each substitution and join everything together
+        parts = list(self.segments)
+        for iSegment, iSub in self.slots : parts[iSegment] = str(subs[iSub].getOutput())
+        return "".join(parts)
+
+def newSubstitutionFromPoint(point, fuzzplan, rng) :
+    return Substitution(point, fuzzplan, rng=rng)
 
-def newSubstitutionFromString(s,fuzzplan) :
-    match = re.match(subPointRegex,s)
-    return newSubstitutionFromMatch(match, fuzzplan)
+def newSubstitutionFromString(s, fuzzplan, rng) :
+    return newSubstitutionFromPoint(fuzzplan.compileSubstitutionPoint(s), fuzzplan, rng)
 
-class CommandTemplate :
+class CommandTemplate(object) :
     """This class represents a template for a command, such as 'curl http://localhost/thing/@{numeric}/'"""
-    def __init__(self, fuzzplan=None, string=None, orig=None) :
+    __slots__ = ("fuzzplan", "template", "subs", "output")
+    def __init__(self, fuzzplan=None, template=None, orig=None, rng=None) :
         if orig is not None : # copy
-            self.subs = dict()
-            for kSub, vSub in orig.subs.items() : self.subs[kSub] = Substitution(orig=vSub)
+            self.subs = orig.subs # a tuple, shared until one of its substitutions is mutated
             self.fuzzplan = orig.fuzzplan
-            self.string = orig.string
+            self.template = orig.template
             self.output = orig.output
-        elif fuzzplan is not None and string is not None : # new
-            self.subs = dict()
+        elif fuzzplan is not None and template is not None and rng is not None : # new
+            # template is a CompiledTemplate that was built when the plan file was read
             self.fuzzplan = fuzzplan
-            self.string = string
-            self.output = string
+            self.template = template
+            self.subs = tuple(newSubstitutionFromPoint(point, fuzzplan, rng) for point in template.points)
+            self.output = None # None means the command needs to be rendered again
         else :
-            raise Exception("Please pass fuzzplan,string  or  orig  to  CommandTemplate")
+            raise Exception("Please pass fuzzplan,template,rng  or  orig  to  CommandTemplate")
     def getOutput(self) : 
-        self.performSubstitutions()
+        if self.output is None : self.performSubstitutions()
         return self.output
     def getSubs(self) : return self.subs
-    def setSubs(self, subs) : self.subs = subs
-    def mutate(self) :
-        sub = random.choice(self.subs)
-        sub.mutate()
+    def setSubs(self, subs) :
+        self.subs = subs
+        self.output = None
+    def hasSubs(self, head=None) :
+        if head is None : return len(self.subs) > 0
+        return any(sub.point.head == head for sub in self.subs)
+    def mutate(self, rng, head=None) :
+        # Copy the chosen substitution (with the given head, if one is given) before
+        #   mutating it, since other sequences may still be sharing the original
+        if head is None : iSub = rng.randrange(len(self.subs))
+        else : iSub = rng.choice([i for i, sub in enumerate(self.subs) if sub.point.head == head])
+        sub = Substitution(orig=self.subs[iSub])
+        sub.mutate(rng)
+        self.subs = self.subs[:iSub] + (sub,) + self.subs[iSub+1:]
+        self.output = None
     def performSubstitutions(self) :
-        # This regular expression matches things like @{alphanumeric} or @{numeric}
-        lastIndex = 0
-        self.output = ""
-        # Look for substitution points in self.string
-        for iSub, match in enumerate(re.finditer(subPointRegex, self.string)) :
-            if iSub not in self.subs :
-                self.subs[iSub] = newSubstitutionFromMatch(match, self.fuzzplan)
-            replacement = self.subs[iSub].getOutput()
-            # Add a chunk of literal string, followed by the replacement
-            self.output += self.string[lastIndex:match.start()] + str(replacement)
-            lastIndex = match.end()
-            # Now look for another substitution point
-            match = re.search(subPointRegex, self.string)
-        self.output += self.string[lastIndex:len(self.string)]
+        self.output = self.template.render(self.subs)
 
-class CommandSequence :
+mutationRngs = threading.local()
+def seedFromKey(seedKey) :
+    # The RNG for a sequence whose seed key (a hex digest) is seedKey.  It is only good until
+    #   the next call: reseeding one Random per thread costs half as much as making a new one,
+    #   and every mutation needs one.
+    rng = getattr(mutationRngs, "rng", None)
+    if rng is None : rng = mutationRngs.rng = random.Random()
+    rng.seed(int(seedKey[:16], 16))
+    return rng
+
+class CommandBlock(object) :
+    """This class represents one block of commands within a sequence, along with its rendered text"""
+    __slots__ = ("commands", "rendered")
+    def __init__(self, commands) :
+        self.commands = commands # a tuple of CommandTemplates
+        self.rendered = None # None means the block needs to be rendered again
+    def render(self) :
+        # A block is replaced, rather than changed, when one of its commands is mutated,
+        #   so its text only has to be built once.  Unchanged commands keep their own text.
+        if self.rendered is None :
+            self.rendered = "".join([command.getOutput() + "\n" for command in self.commands])
+        return self.rendered
+
+class CommandSequence(object) :
+    """This class represents a whole script: a header block, some body blocks and a footer block"""
+    # Sequences are copy-on-write: a copy shares all of its blocks, commands and substitutions
+    #   with the original, and a mutation copies only the block, command and substitution it changes.
+    #   So nothing reachable from commandBlocks may ever be modified in place.
+    # Every random choice is made with an RNG derived from the campaign seed and the sequence's
+    #   lineage (the labels and choices of the mutations that led to it), so any sequence can
+    #   be rebuilt from just those, by Fuzzplan.rebuildSequence().
+    __slots__ = ("fuzzplan", "commandBlocks", "script", "outputValues", "exitStatus", "trialId", "parentId",
+                 "lineage", "seedKey", "parentLineage", "objectiveStats")
     def __init__(self, fuzzplan=None, orig=None) :
         if orig is not None :
             self.fuzzplan = orig.fuzzplan
-            self.commandBlocks = list()
-            for vBlock in orig.commandBlocks :
-                commandBlock = list()
-                for vCommand in vBlock :
-                    commandBlock.append(CommandTemplate(orig=vCommand))
-                self.commandBlocks.append(commandBlock)
-            self.outputValues = copy.deepcopy(orig.outputValues)
+            self.commandBlocks = orig.commandBlocks # a tuple of CommandBlocks
+            self.script = orig.script
+            self.outputValues = orig.outputValues # replaced, never modified, by recordResult
+            self.exitStatus = orig.exitStatus
+            self.trialId = orig.trialId
+            self.parentId = orig.parentId
+            self.lineage = orig.lineage
+            self.seedKey = orig.seedKey
+            self.parentLineage = orig.parentLineage
+            self.objectiveStats = orig.objectiveStats
         elif fuzzplan is not None :
             self.fuzzplan = fuzzplan
             self.outputValues = dict()
-            self.newCommandSequence()
-    def newCommandBlock(self) :
-        blockPlan = random.choice(self.fuzzplan.bodyBlocks)
-        newBlock = list()
-        for commandTemplate in blockPlan :
-            newBlock.append(CommandTemplate(self.fuzzplan, commandTemplate))
-        return newBlock
-    def newCommandSequence(self) :
+            self.exitStatus = None
+            self.trialId = None # the trial's number in the TrialArchive, once it has been run
+            self.parentId = None # the number of the trial that this sequence is a mutant of
+            self.lineage = None # (parent's lineage, label, choice, donor's trial number) for each mutation so far
+            self.seedKey = hashlib.sha1(fuzzplan.getCampaignSeed()).hexdigest()
+            self.parentLineage = None # the lineage of trial parentId
+            self.objectiveStats = None # (runs, mean, sum of squared deviations) of the objective, over every run
+            self.newCommandSequence(seedFromKey(self.seedKey))
+    def makeCommandBlock(self, blockPlan, rng) :
+        return CommandBlock(tuple(CommandTemplate(self.fuzzplan, commandTemplate, rng=rng) for commandTemplate in blockPlan))
+    def newCommandBlock(self, rng) :
+        return self.makeCommandBlock(rng.choice(self.fuzzplan.bodyBlocks), rng)
+    def newCommandSequence(self, rng) :
         bodySequence = list()
         for i in range(self.fuzzplan.getIntParam("nCommands")) :
-            bodySequence.append(self.newCommandBlock())
-        headerBlock = list()
-        for commandTemplate in self.fuzzplan.header :
-            headerBlock.append(CommandTemplate(self.fuzzplan, commandTemplate))
-        footerBlock = list()
-        for commandTemplate in self.fuzzplan.footer :
-            footerBlock.append(CommandTemplate(self.fuzzplan, commandTemplate))
-        self.commandBlocks = [headerBlock] + bodySequence + [footerBlock]
-    def mutateCommandSequence(self) :
-        if random.random() < self.fuzzplan.getFloatParam("fuzzProbMutateSubstitution") :
-            commandsContainingSubstitutions = list()
-            for iBlock in range(len(self.commandBlocks)) :
-                for iCommand in range(len(self.commandBlocks[iBlock])) :
-                    if len(self.commandBlocks[iBlock][iCommand].getSubs()) > 0 :
-                        commandsContainingSubstitutions.append( (iBlock,iCommand) )
-            if len(commandsContainingSubstitutions) > 0 :
-                # Pick a command that has a substitution point
-                iBlock, iCommand = random.choice(commandsContainingSubstitutions)
-                # Mutate just that one substitution point of that one command
-                self.commandBlocks[iBlock][iCommand].mutate()
-                return
-        if len(self.commandBlocks) == 0 :
-            self.commandBlocks.append(self.newCommandBlock())
-            return
-        # Could also opt to change length, swap command positions, etc.
+            bodySequence.append(self.newCommandBlock(rng))
+        headerBlock = self.makeCommandBlock(self.fuzzplan.header, rng)
+        footerBlock = self.makeCommandBlock(self.fuzzplan.footer, rng)
+        self.commandBlocks = (headerBlock,) + tuple(bodySequence) + (footerBlock,)
+        self.script = None
+    def setCommandBlocks(self, commandBlocks) :
+        self.commandBlocks = commandBlocks
+        self.script = None
+    def replaceBlock(self, iBlock, block) :
+        self.commandBlocks = self.commandBlocks[:iBlock] + (block,) + self.commandBlocks[iBlock+1:]
+        self.script = None
+    def mutateCommandSequence(self, label, choice=None, donor=None) :
+        # label tells this mutation apart from the parent's other mutations (e.g. the trial
+        #   number), so that each gets its own RNG.  choice is the (operator, head) that the
+        #   MutationScheduler picked, or None for the plain coin flip of fuzzProbMutateSubstitution;
+        #   donor is the other sequence for operator "splice".  Mutating the same sequence with
+        #   the same label, choice and donor always gives the same result.
+        # Returns a record that undoMutation() can use to put the sequence back the way it was.
+        #   Since nothing is ever modified in place, that is just the old tuple of blocks.
+        undo = (self.commandBlocks, self.script, self.outputValues, self.exitStatus, self.trialId, self.parentId,
+                self.lineage, self.seedKey, self.parentLineage, self.objectiveStats)
+        if self.trialId is not None : self.parentId, self.parentLineage = self.trialId, self.lineage
+        self.trialId = None
+        self.objectiveStats = None
+        self.lineage = (self.lineage, label, choice, donor.trialId if donor is not None else None)
+        # (A plain coin flip is seeded from the label alone, so it mutates just as before there were schedulers)
+        step = repr(label) if choice is None and donor is None else repr((label, choice)) + (donor.seedKey if donor is not None else "")
+        self.seedKey = hashlib.sha1(self.seedKey + step).hexdigest()
+        with self.fuzzplan.profiler.phase("mutate") :
+            self.applyMutation(seedFromKey(self.seedKey), choice, donor)
+        return undo
+    def undoMutation(self, undo) :
+        (self.commandBlocks, self.script, self.outputValues, self.exitStatus, self.trialId, self.parentId,
+         self.lineage, self.seedKey, self.parentLineage, self.objectiveStats) = undo
+    def getChoice(self) :
+        # The (operator, head) of the latest mutation, if the scheduler picked one
+        return self.lineage[2] if self.lineage is not None else None
+    def stepsSinceParent(self) :
+        # The (label, choice, donor's trial number) of each mutation since trial parentId, oldest first
+        steps = list()
+        node = self.lineage
+        while node is not self.parentLineage and node is not None :
+            steps.append(node[1:])
+            node = node[0]
+        steps.reverse()
+        return steps
+    def __getstate__(self) :
+        # For saving and checkpointing.  The lineage is a chain as long as the whole campaign,
+        #   too deep to pickle as it stands, and only the mutations since the parent trial are
+        #   ever needed (by stepsSinceParent), so just those are saved, as a flat list.  Without
+        #   an archive no trial is ever rebuilt, so just the latest mutation (for getChoice) is.
+        if self.fuzzplan.getTrialArchive() is not None : steps = self.stepsSinceParent()
+        elif self.lineage is not None : steps = [self.lineage[1:]]
+        else : steps = []
+        state = dict((name, getattr(self, name)) for name in self.__slots__ if name not in ("lineage", "parentLineage"))
+        state["script"] = None # it is rendered again when it's needed
+        state["steps"] = steps
+        state["parentStep"] = self.parentLineage[1:] if self.parentLineage is not None and len(steps) > 0 else None
+        return state
+    def __setstate__(self, state) :
+        state = dict(state)
+        self.objectiveStats = None # (not in checkpoints written before it was added)
+        node = None
+        if state["parentStep"] is not None : node = (None,) + state["parentStep"]
+        self.parentLineage = node
+        for step in state.pop("steps") : node = (node,) + tuple(step)
+        self.lineage = node
+        del state["parentStep"]
+        for name, value in state.items() : setattr(self, name, value)
+    # The operators that change which body blocks the sequence has (as opposed to mutating a
+    #   substitution), and the methods that apply them.  Each one falls back to "replace" when
+    #   it can't be applied, e.g. "delete" when the sequence is already at minCommands.
+    blockOperators = collections.OrderedDict([("replace", "replaceRandomBlock"), ("insert", "insertBlock"),
+                                              ("delete", "deleteBlock"), ("swap", "swapBlocks"),
+                                              ("duplicate", "duplicateBlock"), ("splice", "spliceBlocks"),
+                                              ("crossover", "crossoverBlocks"), ("randomize", "randomizeBlocks")])
+    donorOperators = ("splice", "crossover") # the operators that take a donor sequence
+    def applyMutation(self, rng, choice, donor) :
+        if choice is None :
+            # No scheduler: flip a coin between a substitution and replacing a block
+            if rng.random() < self.fuzzplan.getFloatParam("fuzzProbMutateSubstitution") : choice = ("substitution", None)
+            else : choice = ("replace", None)
+        operator, head = choice
+        if operator == "substitution" :
+            if self.mutateSubstitution(rng, head) : return
+            operator = "replace" # there was no such substitution to mutate
+        if operator in self.donorOperators : getattr(self, self.blockOperators[operator])(rng, donor)
+        else : getattr(self, self.blockOperators[operator])(rng)
+    def mutateSubstitution(self, rng, head) :
+        # Mutate one substitution (with the given head, or any head if it is None).
+        #   Returns False if the sequence has no such substitution.
+        commandsContainingSubstitutions = list()
+        for iBlock in range(len(self.commandBlocks)) :
+            for iCommand in range(len(self.commandBlocks[iBlock].commands)) :
+                if self.commandBlocks[iBlock].commands[iCommand].hasSubs(head) :
+                    commandsContainingSubstitutions.append( (iBlock,iCommand) )
+        if len(commandsContainingSubstitutions) == 0 : return False
+        # Pick a command that has a substitution point
+        iBlock, iCommand = rng.choice(commandsContainingSubstitutions)
+        # Mutate just that one substitution point of that one command,
+        #   copying the command and its block first
+        commands = self.commandBlocks[iBlock].commands
+        command = CommandTemplate(orig=commands[iCommand])
+        command.mutate(rng, head)
+        self.replaceBlock(iBlock, CommandBlock(commands[:iCommand] + (command,) + commands[iCommand+1:]))
+        return True
+    # The body blocks are commandBlocks[1:-1]; block 0 is the header and the last is the footer
+    def nBody(self) : return len(self.commandBlocks) - 2
+    def setBody(self, body) : self.setCommandBlocks((self.commandBlocks[0],) + tuple(body) + (self.commandBlocks[-1],))
+    def replaceRandomBlock(self, rng) :
         # Entirely replace the i^{th} command block
-        # (Except, don't replace block 0 (the header) or the final block (the footer)
-        i = random.choice(range(1,len(self.commandBlocks)-1))
-        self.commandBlocks[i] = self.newCommandBlock()
-    def execute(self) :
-        scriptFile = tempfile.NamedTemporaryFile(delete=False)
-        scriptPath = scriptFile.name
-        # Write our commands into the script file:
-        for block in self.commandBlocks :
-            for command in block : 
-                print >>scriptFile, command.getOutput()
-        scriptFile.close()
-        #https://stackoverflow.com/questions/12791997/how-do-you-do-a-simple-chmod-x-from-within-python
-        os.chmod(scriptPath, os.stat(scriptPath).st_mode | stat.S_IEXEC)
-        # Finally, we actually run the script:
-        child = subprocess.Popen([scriptPath],stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True)
-        stdout, stderr = child.communicate()
-        self.outputValues = dict()
-        # Scan the output printed by the script for lines of the form:
-        #    ALL_CAPS_TEXT:=...anything...
-        # These are output values produced by the script
-        for line in stdout.split("\n") :
+        if self.nBody() == 0 : return self.insertBlock(rng)
+        i = rng.randrange(1, len(self.commandBlocks)-1)
+        self.replaceBlock(i, self.newCommandBlock(rng))
+    def insertBlock(self, rng) :
+        if self.nBody() >= self.fuzzplan.getMaxCommands() : return self.replaceRandomBlock(rng)
+        i = rng.randrange(1, len(self.commandBlocks))
+        self.setCommandBlocks(self.commandBlocks[:i] + (self.newCommandBlock(rng),) + self.commandBlocks[i:])
+    def deleteBlock(self, rng) :
+        if self.nBody() <= self.fuzzplan.getIntParam("minCommands") : return self.replaceRandomBlock(rng)
+        i = rng.randrange(1, len(self.commandBlocks)-1)
+        self.setCommandBlocks(self.commandBlocks[:i] + self.commandBlocks[i+1:])
+    def swapBlocks(self, rng) :
+        if self.nBody() < 2 : return self.replaceRandomBlock(rng)
+        i, j = sorted(rng.sample(range(1, len(self.commandBlocks)-1), 2))
+        blocks = self.commandBlocks
+        self.setCommandBlocks(blocks[:i] + (blocks[j],) + blocks[i+1:j] + (blocks[i],) + blocks[j+1:])
+    def duplicateBlock(self, rng) :
+        # Blocks are never modified in place, so the copy can simply be the same block
+        if self.nBody() == 0 or self.nBody() >= self.fuzzplan.getMaxCommands() : return self.replaceRandomBlock(rng)
+        block = self.commandBlocks[rng.randrange(1, len(self.commandBlocks)-1)]
+        i = rng.randrange(1, len(self.commandBlocks))
+        self.setCommandBlocks(self.commandBlocks[:i] + (block,) + self.commandBlocks[i:])
+    def spliceBlocks(self, rng, donor) :
+        # The start of this sequence's body, followed by the end of the donor's
+        if donor is None or donor.nBody() == 0 : return self.replaceRandomBlock(rng)
+        body = self.commandBlocks[1:-1]
+        donorBody = donor.commandBlocks[1:-1]
+        body = body[:rng.randint(0, len(body))] + donorBody[rng.randrange(len(donorBody)):]
+        self.setBody(body[:self.fuzzplan.getMaxCommands()])
+    def crossoverBlocks(self, rng, donor) :
+        # Two-point crossover: a run of this sequence's body blocks is replaced by a run of the
+        #   donor's.  The header and footer are this sequence's own.
+        if donor is None or donor.nBody() == 0 : return self.replaceRandomBlock(rng)
+        body = self.commandBlocks[1:-1]
+        donorBody = donor.commandBlocks[1:-1]
+        a = rng.randint(0, len(body))
+        b = rng.randint(a, len(body))
+        c = rng.randint(0, len(donorBody))
+        d = rng.randint(c, len(donorBody))
+        body = body[:a] + donorBody[c:d] + body[b:]
+        if len(body) < self.fuzzplan.getIntParam("minCommands") : return self.spliceBlocks(rng, donor)
+        self.setBody(body[:self.fuzzplan.getMaxCommands()])
+    def randomizeBlocks(self, rng) :
+        # Start again from scratch, as for a brand new sequence
+        self.newCommandSequence(rng)
+    def render(self) :
+        # Produce the text of the shell script for this sequence, out of the text
+        #   that each block has already rendered
+        if self.script is None :
+            self.script = "".join([block.render() for block in self.commandBlocks])
+        return self.script
+    def recordResult(self, result) :
+        # The output values were already picked out of stdout while the script was running
+        self.exitStatus = result.status
+        self.outputValues = result.outputValues
+        if not result.cached : self.addObjectiveSample(objectiveOf(result.outputValues))
+        archive = self.fuzzplan.getTrialArchive()
+        if archive is not None :
+            self.trialId = archive.add(self.render(), result, self.parentId, self.stepsSinceParent(),
+                                       self.fuzzplan.getCampaignSeed())
+        if result.cached :
+            # Nothing was run, so there is no stdout to show; just show the output values again
+            print "======== (cached result)"
+            for key in sorted(result.outputValues) : print "%s:=%s" % (key, result.outputValues[key])
+            return
+        for line in result.stdout.split("\n") :
             print line.rstrip()
-            matches = re.match("([A-Z0-9_]+):=(.*)", line.rstrip())
-            if matches :
-                self.outputValues[matches.group(1)] = matches.group(2)
-        os.remove(scriptPath)
+        if result.truncated :
+            print "======== (output truncated after %d bytes)" % self.fuzzplan.getIntParam("maxOutputBytes")
+        if result.stoppedEarly :
+            print "======== (stopped early; all of stopAfterOutputs had been printed)"
+        if result.timedOut :
+            print "======== (killed after trialTimeout of %s seconds)" % self.fuzzplan.getFloatParam("trialTimeout")
+        if result.outputValues.get("TRIAL_OUTCOME") not in (None, "ok", "stopped") :
+            # Show how the trial ended the way the script would have, since it couldn't say so itself
+            for key in ("TRIAL_OUTCOME", "TRIAL_EXIT_CODE", "TRIAL_SIGNAL") :
+                if key in result.outputValues : print "%s:=%s" % (key, result.outputValues[key])
+    def execute(self) :
+        self.fuzzplan.executeAll([self])
     def getOutputValue(self, key) :
         if key not in self.outputValues : return None
         return self.outputValues[key]
+    def getObjective(self) :
+        # Of the latest run
+        return objectiveOf(self.outputValues)
+    def addObjectiveSample(self, objective) :
+        # Welford's running mean and variance, over every run of this sequence
+        if objective is None : return
+        n, mean, m2 = self.objectiveStats if self.objectiveStats is not None else (0, 0.0, 0.0)
+        n += 1
+        delta = objective - mean
+        mean += delta / n
+        m2 += delta * (objective - mean)
+        self.objectiveStats = (n, mean, m2)
+
+def objectiveOf(outputValues) :
+    # The OBJECTIVE output value as a number, or None if there isn't a usable one
+    try : return float(outputValues["OBJECTIVE"].strip())
+    except (KeyError, ValueError) : return None
+
+# Scripts report output values by printing lines of the form:
+#    ALL_CAPS_TEXT:=...anything...
+outputValueRegex = re.compile("([A-Z0-9_]+):=(.*)")
+
+maxLineLength = 65536 # longer lines are cut short before being scanned for output values
+readSize = 65536
+
+class TrialResult(object) :
+    """This class holds what one trial's script printed to stdout, and its exit status"""
+    __slots__ = ("stdout", "status", "outputValues", "truncated", "stoppedEarly", "timedOut", "cached", "spawnTime", "parseTime",
+                 "runTime")
+    def __init__(self, stdout, status, outputValues=None, truncated=False, stoppedEarly=False, cached=False, timedOut=False) :
+        self.stdout = stdout # at most maxOutputBytes of it
+        self.status = status # None if the trial was killed before it could report one
+        self.outputValues = outputValues if outputValues is not None else dict()
+        self.truncated = truncated
+        self.stoppedEarly = stoppedEarly
+        self.timedOut = timedOut # True if the trial was killed for running longer than trialTimeout
+        self.cached = cached # True if the script wasn't run, because its result was in the ResultCache
+        self.spawnTime = 0.0 # seconds spent starting the script, and scanning its output
+        self.parseTime = 0.0
+        self.runTime = 0.0 # wall-clock seconds from starting the script until it exited or was stopped
+
+class OutputParser(object) :
+    """This class scans a trial's stdout for output values while it is still being printed"""
+    __slots__ = ("maxOutputBytes", "kept", "nKept", "truncated", "partial", "outputValues", "awaiting", "parseTime",
+                 "memoryLimited", "outcomeObjectives")
+    def __init__(self, maxOutputBytes, stopAfterOutputs, memoryLimited=False, outcomeObjectives=None) :
+        self.maxOutputBytes = maxOutputBytes
+        self.kept = list() # the part of stdout that we hold on to, for printing
+        self.nKept = 0
+        self.truncated = False
+        self.partial = "" # the start of a line whose end hasn't arrived yet
+        self.outputValues = dict()
+        # Keys which, once all of them have been printed, let the trial be stopped early
+        self.awaiting = set(stopAfterOutputs) if len(stopAfterOutputs) > 0 else None
+        self.parseTime = 0.0
+        self.memoryLimited = memoryLimited # whether trials run under a trialMemoryLimit
+        self.outcomeObjectives = outcomeObjectives if outcomeObjectives is not None else dict()
+    def feed(self, data) :
+        start = time.time()
+        room = self.maxOutputBytes - self.nKept
+        if len(data) > room : self.truncated = True
+        if room > 0 :
+            self.kept.append(data[:room])
+            self.nKept += min(room, len(data))
+        pieces = data.split("\n")
+        for piece in pieces[:-1] :
+            self.addToLine(piece)
+            self.endLine()
+        self.addToLine(pieces[-1])
+        self.parseTime += time.time() - start
+    def addToLine(self, piece) :
+        if len(self.partial) < maxLineLength : self.partial += piece[:maxLineLength - len(self.partial)]
+    def endLine(self) :
+        matches = outputValueRegex.match(self.partial.rstrip())
+        self.partial = ""
+        if matches :
+            self.outputValues[matches.group(1)] = matches.group(2)
+            if self.awaiting is not None : self.awaiting.discard(matches.group(1))
+    def isDone(self) : return self.awaiting is not None and len(self.awaiting) == 0
+    def finish(self, status, stoppedEarly=False, timedOut=False) :
+        if len(self.partial) > 0 : self.endLine()
+        self.addOutcome(status, stoppedEarly, timedOut)
+        result = TrialResult("".join(self.kept), status, self.outputValues, self.truncated, stoppedEarly, timedOut=timedOut)
+        result.parseTime = self.parseTime
+        return result
+    def addOutcome(self, status, stoppedEarly, timedOut) :
+        # Add output values that say how the trial ended, so that the modes can score them like
+        #   any other: TRIAL_OUTCOME, and TRIAL_EXIT_CODE or TRIAL_SIGNAL.  A shell reports a
+        #   command killed by signal n as exit status 128 + n, and Popen as a returncode of -n.
+        signalNumber = None
+        if status is not None and status < 0 : signalNumber = -status
+        elif status is not None and 128 < status < 128 + signal.NSIG : signalNumber = status - 128
+        if timedOut : outcome = "timeout"
+        elif stoppedEarly : outcome = "stopped"
+        elif status is None : outcome = "lost" # the shell, harness or remote worker running it died
+        elif signalNumber == signal.SIGXCPU : outcome = "cpu"
+        # Under a memory limit, a SIGKILL that we didn't send most likely came from the kernel's
+        #   OOM killer, and a crash from an allocation that failed
+        elif self.memoryLimited and signalNumber in (signal.SIGKILL, signal.SIGSEGV, signal.SIGABRT, signal.SIGBUS) : outcome = "memory"
+        elif signalNumber is not None : outcome = "signal"
+        elif status != 0 : outcome = "exit"
+        else : outcome = "ok"
+        self.outputValues["TRIAL_OUTCOME"] = outcome
+        if signalNumber is not None : self.outputValues["TRIAL_SIGNAL"] = str(signalNumber)
+        elif status is not None : self.outputValues["TRIAL_EXIT_CODE"] = str(status)
+        if outcome in self.outcomeObjectives : self.outputValues["OBJECTIVE"] = self.outcomeObjectives[outcome]
+
+def waitForOutput(fd, deadline) :
+    # Wait until fd can be read, or until deadline (a time.time(), or None for never) passes.
+    #   Returns False if the deadline passed first.
+    if deadline is None : return True
+    remaining = deadline - time.time()
+    return remaining > 0 and len(select.select([fd], [], [], remaining)[0]) > 0
+
+# The command line for a /bin/sh that runs the script written to its stdin.  It moves that pipe to
+#   fd 3 and reads the script from there, so that the script's own stdin is /dev/null and it can't
+#   eat the rest of itself.  The script never touches the filesystem, and unlike with sh -c, there
+#   is no limit on its length.
+pipedShellCommand = ["/bin/sh", "-c", "exec /bin/sh /dev/fd/3 3<&0 </dev/null"]
+
+def feedScript(pipe, script) :
+    # Write the script to a child's stdin and close it.  The child reads the script as it runs, and
+    #   may fill its stdout pipe while doing so, so a script that might not fit in the pipe's
+    #   buffer is written from a thread of its own.
+    def write() :
+        try :
+            pipe.write(script)
+            pipe.close()
+        except IOError : pass # the shell exited without reading all of it
+    if len(script) <= select.PIPE_BUF : write()
+    else :
+        writer = threading.Thread(target=write)
+        writer.daemon = True
+        writer.start()
+
+class PopenWorker :
+    """This class runs each trial script in a freshly spawned /bin/sh"""
+    def __init__(self, fuzzplan) :
+        self.fuzzplan = fuzzplan
+    def run(self, script) :
+        spawnStart = time.time()
+        child = subprocess.Popen(pipedShellCommand,stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                 stderr=devnull,close_fds=True,preexec_fn=self.fuzzplan.trialPreexec())
+        feedScript(child.stdin, script)
+        spawnTime = time.time() - spawnStart
+        deadline = self.fuzzplan.trialDeadline(spawnStart)
+        parser = self.fuzzplan.newOutputParser()
+        stoppedEarly = False
+        timedOut = False
+        while True :
+            if not waitForOutput(child.stdout.fileno(), deadline) :
+                timedOut = True
+                break
+            data = os.read(child.stdout.fileno(), readSize)
+            if data == "" : break
+            parser.feed(data)
+            if parser.isDone() :
+                # We have every output value we need, so don't wait for the rest of the trial
+                try : os.killpg(child.pid, signal.SIGKILL)
+                except OSError : pass
+                stoppedEarly = True
+                break
+        child.stdout.close()
+        # The output has ended, but the shell may not have exited yet
+        while deadline is not None and not timedOut and child.poll() is None :
+            if time.time() >= deadline : timedOut = True
+            else : time.sleep(0.01)
+        if timedOut :
+            try : os.killpg(child.pid, signal.SIGKILL)
+            except OSError : pass
+        child.wait()
+        result = parser.finish(None if stoppedEarly or timedOut else child.returncode, stoppedEarly, timedOut)
+        result.spawnTime = spawnTime
+        return result
+    def close(self) : pass
+
+class ShellWorker :
+    """This class represents a long-lived /bin/sh process that starts one trial script at a time"""
+    # The shell saves spawning a process from Python for every trial.  Each trial still runs in
+    #   its own /bin/sh, started with setsid, so that it has its own $$, can't change the next
+    #   trial's variables, working directory, traps, etc., and leads its own process group.  When
+    #   the trial's shell exits, whatever it left running in the background is killed, before
+    #   the end marker is printed, so nothing it prints later can land in another trial's output.
+    def __init__(self, fuzzplan) :
+        self.fuzzplan = fuzzplan
+        self.child = None
+        self.trialPid = None # the process group of the trial that is running, once it has said so
+    @staticmethod
+    def isAvailable() :
+        # Trials are started with the setsid command (from util-linux), which e.g. macOS lacks
+        return any(os.access(os.path.join(directory, "setsid"), os.X_OK) for directory in os.environ.get("PATH", "").split(":"))
+    def start(self) :
+        if not self.isAvailable() : raise Exception("Executor shell needs the setsid command (from util-linux); use executor popen instead")
+        # The shell leads its own process group, so it can be killed along with everything it started
+        self.child = subprocess.Popen(["/bin/sh"],stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                      stderr=devnull,close_fds=True,preexec_fn=self.fuzzplan.trialPreexec(cpu=False))
+    def run(self, script) :
+        # The time to hand the script to the shell (and to restart the shell, if need be)
+        #   is recorded as the trial's spawn time
+        spawnStart = time.time()
+        result = self.runFramed(script, spawnStart)
+        if result.spawnTime == 0.0 : result.spawnTime = time.time() - spawnStart
+        return result
+    def runFramed(self, script, spawnStart) :
+        if self.child is None or self.child.poll() is not None : self.start()
+        # Each trial's output is framed by a pair of marker lines carrying a fresh token.  The
+        #   trial's shell prints the begin marker itself, along with its process ID.  The script
+        #   reaches that shell through a here-document on fd 3 (a pipe, so it never touches the
+        #   filesystem, and there is no limit on its length), and its stdin is /dev/null, so it
+        #   can't eat the next trial.  It sets its own trialCpuLimit, since the long-lived shell's
+        #   would count every trial that shell has run.
+        token = "FUZZPLAN_" + binascii.hexlify(os.urandom(8))
+        cpuLimit = self.fuzzplan.getIntParam("trialCpuLimit")
+        if not script.endswith("\n") : script += "\n"
+        request = ("setsid /bin/sh /dev/fd/3 </dev/null 2>/dev/null 3<<'%s_SCRIPT' &\n" % token +
+                   "printf '%%s %%d\\n' %s_BEGIN $$\n" % token +
+                   ("ulimit -S -t %d\n" % cpuLimit if cpuLimit > 0 else "") +
+                   script +
+                   "%s_SCRIPT\n" % token +
+                   "FUZZPLAN_PID=$!\n" +
+                   "wait $FUZZPLAN_PID\n" +
+                   "FUZZPLAN_STATUS=$?\n" +
+                   "kill -9 -$FUZZPLAN_PID 2>/dev/null\n" +
+                   "printf '\\n%%s %%d\\n' %s_END \"$FUZZPLAN_STATUS\"\n" % token)
+        parser = self.fuzzplan.newOutputParser()
+        self.trialPid = None
+        try :
+            self.child.stdin.write(request)
+            self.child.stdin.flush()
+        except IOError :
+            self.kill()
+            return parser.finish(None)
+        spawnTime = time.time() - spawnStart
+        # A trial that runs past trialTimeout is stopped by killing its process group, as for stopAfterOutputs
+        deadline = self.fuzzplan.trialDeadline(spawnStart)
+        beginMarker = token + "_BEGIN "
+        endMarker = "\n" + token + "_END " # the end marker line is printed with a newline in front
+        fd = self.child.stdout.fileno()
+        stream = "" # bytes that have been read but not yet handed to the parser
+        began = False
+        while True :
+            if not waitForOutput(fd, deadline) : return self.stopTrial(parser, spawnTime, timedOut=True)
+            data = os.read(fd, readSize)
+            if data == "" : # the shell died
+                self.kill()
+                if began : parser.feed(stream)
+                return parser.finish(None)
+            stream += data
+            if not began :
+                # Skip anything left over from before this trial began (such as the end marker
+                #   of a trial that was stopped early)
+                iBegin = stream.find(beginMarker)
+                if iBegin < 0 :
+                    stream = stream[-len(beginMarker):]
+                    continue
+                iNewline = stream.find("\n", iBegin)
+                if iNewline < 0 :
+                    stream = stream[iBegin:]
+                    continue
+                self.trialPid = int(stream[iBegin+len(beginMarker):iNewline])
+                stream = stream[iNewline+1:]
+                began = True
+            iEnd = stream.find(endMarker)
+            if iEnd >= 0 :
+                parser.feed(stream[:iEnd])
+                stream = stream[iEnd+len(endMarker):]
+                while "\n" not in stream :
+                    if not waitForOutput(fd, deadline) : return self.stopTrial(parser, spawnTime, timedOut=True)
+                    data = os.read(fd, readSize)
+                    if data == "" :
+                        self.kill()
+                        return parser.finish(None)
+                    stream += data
+                # Anything after the end marker is thrown away
+                self.trialPid = None
+                result = parser.finish(int(stream[:stream.index("\n")]))
+                result.spawnTime = spawnTime
+                return result
+            # If the stream ends with what could be the start of the end marker, hold that back
+            #   until more arrives.  Whatever precedes that newline is a complete line either way.
+            iLastNewline = stream.rfind("\n")
+            if iLastNewline >= 0 and endMarker.startswith(stream[iLastNewline:]) :
+                parser.feed(stream[:iLastNewline])
+                parser.endLine()
+                stream = stream[iLastNewline:]
+            else :
+                parser.feed(stream)
+                stream = ""
+            if parser.isDone() :
+                # We have every output value we need, so don't wait for the rest of the trial
+                return self.stopTrial(parser, spawnTime, stoppedEarly=True)
+    def stopTrial(self, parser, spawnTime, stoppedEarly=False, timedOut=False) :
+        # Kill the trial's process group.  The long-lived shell then prints the end marker,
+        #   which the next trial skips.  If the trial hasn't said who it is yet, the shell has
+        #   to go too, and a new one is started for the next trial.
+        if self.trialPid is not None :
+            try : os.killpg(self.trialPid, signal.SIGKILL)
+            except OSError : pass
+            self.trialPid = None
+        else : self.kill()
+        result = parser.finish(None, stoppedEarly, timedOut)
+        result.spawnTime = spawnTime
+        return result
+    def kill(self) :
+        if self.trialPid is not None :
+            try : os.killpg(self.trialPid, signal.SIGKILL)
+            except OSError : pass
+            self.trialPid = None
+        if self.child is None : return
+        try : os.killpg(self.child.pid, signal.SIGKILL)
+        except OSError : pass
+        self.child.wait()
+        self.child = None
+    def close(self) :
+        if self.child is None : return
+        try : self.child.stdin.close()
+        except IOError : pass
+        self.child.wait()
+        self.child = None
+
+class PythonWorker :
+    """This class runs trials by calling a Python entry point in a long-lived python_harness.py process"""
+    # The harness imports pythonEntryPoint once, and calls it for each command of each trial,
+    #   so that no interpreter has to be started per command.  It is restarted if it dies, and
+    #   after every pythonRestartEvery trials, in case the target leaks memory or state.  It
+    #   keeps only maxOutputBytes of each trial's output (and the output values after that),
+    #   and the reply is handed to the parser as it arrives, so neither side holds much more.
+    replyHeader = struct.Struct("!iBI") # exit status, whether the output was cut short, length
+    def __init__(self, fuzzplan) :
+        self.fuzzplan = fuzzplan
+        self.child = None
+        self.nTrials = 0 # trials run by the current harness
+    def start(self) :
+        harness = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_harness.py")
+        self.child = subprocess.Popen([self.fuzzplan.getStringParam("pythonInterpreter"), harness,
+                                       self.fuzzplan.getStringParam("pythonEntryPoint"), str(self.fuzzplan.getIntParam("maxOutputBytes"))],
+                                      stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                      stderr=devnull,close_fds=True,preexec_fn=self.fuzzplan.trialPreexec(cpu=False))
+        self.nTrials = 0
+    def run(self, script) :
+        spawnStart = time.time()
+        restartEvery = self.fuzzplan.getIntParam("pythonRestartEvery")
+        if self.child is not None and restartEvery > 0 and self.nTrials >= restartEvery : self.close()
+        if self.child is None or self.child.poll() is not None : self.start()
+        self.nTrials += 1
+        parser = self.fuzzplan.newOutputParser()
+        try :
+            self.child.stdin.write(struct.pack("!I", len(script)) + script)
+            self.child.stdin.flush()
+        except IOError :
+            self.kill()
+            return parser.finish(None)
+        spawnTime = time.time() - spawnStart
+        deadline = self.fuzzplan.trialDeadline(spawnStart)
+        fd = self.child.stdout.fileno()
+        header = ""
+        while len(header) < self.replyHeader.size :
+            if not waitForOutput(fd, deadline) :
+                # A hung entry point can only be stopped by killing the harness; it is restarted for the next trial
+                self.kill()
+                result = parser.finish(None, timedOut=True)
+                result.spawnTime = spawnTime
+                return result
+            data = os.read(fd, self.replyHeader.size - len(header))
+            if data == "" : # the harness crashed, taking the trial with it
+                self.kill()
+                return parser.finish(None)
+            header += data
+        status, truncated, remaining = self.replyHeader.unpack(header)
+        if truncated : parser.truncated = True
+        timedOut = False
+        while remaining > 0 :
+            timedOut = not waitForOutput(fd, deadline)
+            data = os.read(fd, min(remaining, readSize)) if not timedOut else ""
+            if data == "" : # the harness died (or hung) part way through the reply
+                self.kill()
+                status = None
+                break
+            parser.feed(data)
+            remaining -= len(data)
+        result = parser.finish(status, timedOut=timedOut)
+        result.spawnTime = spawnTime
+        return result
+    def kill(self) :
+        if self.child is None : return
+        try : os.killpg(self.child.pid, signal.SIGKILL)
+        except OSError : pass
+        self.child.wait()
+        self.child = None
+    def close(self) :
+        if self.child is None : return
+        try : self.child.stdin.close()
+        except IOError : pass
+        self.child.wait()
+        self.child = None
+
+class ResultCache(object) :
+    """This class remembers the output values of scripts that have already been run, keyed by a hash of the script"""
+    def __init__(self, size, directory, ttl) :
+        self.size = size # how many results to hold in memory; 0 means none
+        self.directory = directory # where to store results on disk; "" means don't
+        self.ttl = ttl # how many seconds a result stays valid; negative means forever
+        self.memory = collections.OrderedDict() # least recently used first
+    def key(self, script) : return hashlib.sha1(script).hexdigest()
+    def path(self, key) : return os.path.join(self.directory, key[:2], key + ".json")
+    def isFresh(self, entry) : return self.ttl < 0 or time.time() - entry["time"] <= self.ttl
+    def lookup(self, key) :
+        entry = self.memory.pop(key, None)
+        if entry is None and len(self.directory) > 0 :
+            try :
+                with open(self.path(key), "r") as entryFile : entry = json.load(entryFile)
+            except (IOError, ValueError) : entry = None
+        if entry is None or not self.isFresh(entry) : return None
+        self.remember(key, entry)
+        # Output values are stored as latin-1, so that any bytes at all come back unchanged
+        outputValues = dict((str(k), v.encode("latin-1")) for k, v in entry["outputValues"].items())
+        return TrialResult("", entry["status"], outputValues, cached=True)
+    def remember(self, key, entry) :
+        if self.size <= 0 : return
+        self.memory[key] = entry
+        while len(self.memory) > self.size : self.memory.popitem(last=False)
+    # Outcomes that say more about the machine at the time (a worker or the network failing, or
+    #   too much load) than about the script, so that running it again may well turn out differently
+    transientOutcomes = ("lost", "timeout")
+    def store(self, key, result) :
+        if result.outputValues.get("TRIAL_OUTCOME") in self.transientOutcomes : return
+        entry = {"time" : time.time(), "status" : result.status,
+                 "outputValues" : dict((k, v.decode("latin-1")) for k, v in result.outputValues.items())}
+        self.remember(key, entry)
+        if len(self.directory) > 0 :
+            # Write to a temporary file first, so that a half-written entry is never read back
+            path = self.path(key)
+            if not os.path.isdir(os.path.dirname(path)) :
+                try : os.makedirs(os.path.dirname(path))
+                except OSError : pass # another process may have just made it
+            tempPath = "%s.%d.tmp" % (path, os.getpid())
+            with open(tempPath, "w") as entryFile : json.dump(entry, entryFile)
+            os.rename(tempPath, path)
+
+class TrialArchive(object) :
+    """This class appends every trial to a compressed archive that can be read back one trial at a time"""
+    # The archive is a directory holding two files:
+    #   trials.dat   blocks of up to blockSize marshalled trial records, each block compressed with zlib
+    #   trials.idx   for trial N, at byte N * indexEntry.size: where its block starts in trials.dat,
+    #                the block's compressed length, and where the record sits within the block
+    # Compressing many records together is much cheaper than compressing each one, and reading
+    #   a trial back still means decompressing just the one block.  A trial is only indexed once
+    #   its block has been written, so a run that is killed part way leaves at worst some
+    #   unindexed bytes at the end of trials.dat.
+    indexEntry = struct.Struct("!QIII")
+    blockSize = 256
+    def __init__(self, directory) :
+        self.directory = directory
+        if not os.path.isdir(directory) : os.makedirs(directory)
+        self.dataPath = os.path.join(directory, "trials.dat")
+        self.indexPath = os.path.join(directory, "trials.idx")
+        self.indexMap = None # for reading
+        self.queue = None # for writing
+        self.failure = None # the traceback of whatever stopped the writer thread, for the fuzzing loop to raise
+    def __len__(self) :
+        if not os.path.exists(self.indexPath) : return 0
+        return os.path.getsize(self.indexPath) // self.indexEntry.size
+    def open(self) :
+        # Get ready to append.  The records are built, compressed and written by a background
+        #   thread, so that add() costs the fuzzing loop next to nothing.
+        self.nTrials = len(self)
+        with open(self.indexPath, "ab") as indexFile : indexFile.truncate(self.nTrials * self.indexEntry.size)
+        self.queue = Queue.Queue()
+        self.writer = threading.Thread(target=self.writeLoop)
+        self.writer.daemon = True
+        self.writer.start()
+    def add(self, script, result, parentId, steps, seed) :
+        # Returns the trial's number within the archive.  steps are the mutations since the
+        #   parent trial (see stepsSinceParent), so that the trial can be rebuilt from the campaign seed.
+        if self.queue is None : self.open()
+        self.checkWriter()
+        iTrial = self.nTrials
+        self.nTrials += 1
+        self.queue.put((iTrial, parentId, steps, seed, time.time(), script, result))
+        return iTrial
+    def makeRecord(self, iTrial, parentId, steps, seed, when, script, result) :
+        return marshal.dumps({"trial" : iTrial, "parent" : parentId, "steps" : steps, "seed" : seed,
+                              "time" : when, "status" : result.status,
+                              "script" : script, "outputValues" : result.outputValues,
+                              "spawnTime" : result.spawnTime, "parseTime" : result.parseTime, "runTime" : result.runTime,
+                              "cached" : result.cached,
+                              "stoppedEarly" : result.stoppedEarly, "timedOut" : result.timedOut})
+    def checkWriter(self) :
+        if self.failure is not None : raise Exception("Archiving trials to %s failed:\n%s" % (self.directory, self.failure))
+    def writeLoop(self) :
+        try : self.writeTrials()
+        except Exception : self.failure = traceback.format_exc()
+    def writeTrials(self) :
+        with open(self.dataPath, "ab") as dataFile :
+            with open(self.indexPath, "ab") as indexFile :
+                dataFile.seek(0, os.SEEK_END)
+                offset = dataFile.tell()
+                done = False
+                while not done :
+                    # Write whatever has piled up since the last time, a block at a time
+                    pending = [self.queue.get()]
+                    while True :
+                        try : pending.append(self.queue.get_nowait())
+                        except Queue.Empty : break
+                    if pending[-1] is None :
+                        pending.pop()
+                        done = True
+                    for iStart in range(0, len(pending), self.blockSize) :
+                        records = [self.makeRecord(*trial) for trial in pending[iStart:iStart+self.blockSize]]
+                        block = zlib.compress("".join(records))
+                        dataFile.write(block)
+                        index = list()
+                        position = 0
+                        for record in records :
+                            index.append(self.indexEntry.pack(offset, len(block), position, len(record)))
+                            position += len(record)
+                        offset += len(block)
+                        dataFile.flush()
+                        indexFile.write("".join(index))
+                        indexFile.flush()
+                    # Let the next batch pile up, rather than waking for every trial
+                    if not done : time.sleep(0.1)
+    def read(self, iTrial) :
+        # Look up one trial; the index is memory-mapped, so this takes the same time for any trial
+        if self.indexMap is None or (iTrial + 1) * self.indexEntry.size > len(self.indexMap) :
+            if iTrial < 0 or iTrial >= len(self) : raise IndexError("No trial %d in %s" % (iTrial, self.directory))
+            if self.indexMap is not None : self.indexMap.close()
+            with open(self.indexPath, "rb") as indexFile :
+                self.indexMap = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, length, position, recordLength = self.indexEntry.unpack_from(self.indexMap, iTrial * self.indexEntry.size)
+        with open(self.dataPath, "rb") as dataFile :
+            dataFile.seek(offset)
+            block = zlib.decompress(dataFile.read(length))
+        return marshal.loads(block[position:position+recordLength])
+    def close(self) :
+        if self.queue is not None :
+            self.queue.put(None)
+            self.writer.join()
+            self.queue = None
+        if self.indexMap is not None : self.indexMap.close()
+        self.indexMap = None
+        self.checkWriter()
+
+class Checkpointer(object) :
+    """This class writes checkpoints of the fuzzing loop in the background, so that a run can be resumed"""
+    # The loop hands over a snapshot (see Fuzzplan.captureState), which costs it next to nothing
+    #   since sequences are copy-on-write; pickling, compressing and writing it happen here.
+    #   A snapshot that is still waiting when a newer one arrives is dropped.  Each checkpoint
+    #   is written to a temporary file that is then renamed over the last one, so a run that is
+    #   killed part way always leaves a whole checkpoint behind.
+    def __init__(self, fuzzplan, path, interval) :
+        self.fuzzplan = fuzzplan
+        self.path = path
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.pending = None # the latest (header, state) not yet written
+        self.closing = False
+        self.failure = None # the traceback of whatever stopped the writer thread, for the fuzzing loop to raise
+        self.writer = threading.Thread(target=self.writeLoop)
+        self.writer.daemon = True
+        self.writer.start()
+    def isDue(self, iTrial) : return self.interval > 0 and iTrial % self.interval == 0
+    def save(self, snapshot) :
+        self.checkWriter()
+        with self.condition :
+            self.pending = snapshot
+            self.condition.notify()
+    def checkWriter(self) :
+        if self.failure is not None : raise Exception("Writing checkpoint %s failed:\n%s" % (self.path, self.failure))
+    def writeLoop(self) :
+        while True :
+            with self.condition :
+                while self.pending is None and not self.closing : self.condition.wait()
+                snapshot, self.pending = self.pending, None
+            if snapshot is None : return
+            try : self.fuzzplan.writeCheckpoint(self.path, *snapshot)
+            except Exception :
+                self.failure = traceback.format_exc()
+                return
+    def close(self) :
+        # Waits for the last checkpoint to be written
+        with self.condition :
+            self.closing = True
+            self.condition.notify()
+        self.writer.join()
+        self.checkWriter()
+
+class Profiler(object) :
+    """This class adds up how long each phase of the fuzzing loop takes, and reports it per trial"""
+    # The main thread's phases add up to (at most) the wall time.  "run" is the time it spends
+    #   waiting for the workers; the workers' own phases happen inside it, several at once, so
+    #   they are reported separately, as the mean per execution.
+    phases = ("clone", "mutate", "render", "cache", "run")
+    overheadPhases = ("clone", "mutate", "render", "cache") # the fuzzer's own work, outside of "run"
+    workerPhases = ("spawn", "parse")
+    def __init__(self, metricsPath, summaryInterval) :
+        self.metricsFile = open(metricsPath, "a") if len(metricsPath) > 0 else None
+        self.summaryInterval = summaryInterval
+        self.startTime = time.time()
+        self.trialTimes = dict((phase, 0.0) for phase in self.phases + self.workerPhases) # for the current trial
+        self.totalTimes = dict((phase, 0.0) for phase in self.phases + self.workerPhases) # since the last summary
+        self.trialExecutions = 0
+        self.totalExecutions = 0
+        self.summaryExecutions = 0
+        self.summaryStart = self.startTime
+    @contextlib.contextmanager
+    def phase(self, name) :
+        start = time.time()
+        try : yield
+        finally : self.trialTimes[name] += time.time() - start
+    def add(self, name, seconds) : self.trialTimes[name] += seconds
+    def countExecutions(self, n) : self.trialExecutions += n
+    def endTrial(self, iTrial) :
+        now = time.time()
+        self.totalExecutions += self.trialExecutions
+        self.summaryExecutions += self.trialExecutions
+        if self.metricsFile is not None :
+            record = {"trial" : iTrial, "time" : now - self.startTime, "executions" : self.trialExecutions,
+                      "execsPerSec" : self.totalExecutions / max(now - self.startTime, 1e-9),
+                      "peakRSSKB" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+            for phase in self.phases : record[phase] = self.trialTimes[phase]
+            for phase in self.workerPhases : record[phase + "PerExec"] = self.trialTimes[phase] / max(self.trialExecutions, 1)
+            self.metricsFile.write(json.dumps(record, sort_keys=True) + "\n")
+            self.metricsFile.flush()
+        for phase in self.phases + self.workerPhases :
+            self.totalTimes[phase] += self.trialTimes[phase]
+            self.trialTimes[phase] = 0.0
+        self.trialExecutions = 0
+        if self.summaryInterval > 0 and iTrial % self.summaryInterval == 0 :
+            self.printSummary(now)
+    def printSummary(self, now) :
+        elapsed = max(now - self.summaryStart, 1e-9)
+        overhead = sum(self.totalTimes[phase] for phase in self.overheadPhases)
+        print "====== METRICS %.1f execs/s, overhead %.1f%% of wall time, peak RSS %d KB" % (
+            self.summaryExecutions / elapsed, 100.0 * overhead / elapsed,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        print "======   " + " ".join("%s=%.1fms" % (phase, 1000.0 * self.totalTimes[phase]) for phase in self.phases) + \
+              "; per execution " + " ".join("%s=%.2fms" % (phase, 1000.0 * self.totalTimes[phase] / max(self.summaryExecutions, 1))
+                                            for phase in self.workerPhases)
+        for phase in self.phases + self.workerPhases : self.totalTimes[phase] = 0.0
+        self.summaryExecutions = 0
+        self.summaryStart = now
+    def close(self) :
+        if self.metricsFile is not None : self.metricsFile.close()
+        self.metricsFile = None
+
+class NullProfiler(object) :
+    """This class stands in for a Profiler when no metrics were asked for"""
+    @contextlib.contextmanager
+    def phase(self, name) : yield
+    def add(self, name, seconds) : pass
+    def countExecutions(self, n) : pass
+    def endTrial(self, iTrial) : pass
+    def close(self) : pass
+
+# These are the values that "##stringparam executor ..." may take
+executorTypes = {"shell" : ShellWorker, "popen" : PopenWorker, "python" : PythonWorker}
+
+class EventTrial(object) :
+    """This class represents one script that an EventEngine has started"""
+    __slots__ = ("tag", "child", "fd", "parser", "startTime", "deadline", "spawnTime")
+
+class EventEngine :
+    """This class runs many trial scripts at once from a single thread, waiting on all of their output together"""
+    # Each script gets its own /bin/sh, which leads its own process group, so that a trial that
+    #   runs past trialTimeout can be killed along with everything it started.  Scripts are
+    #   submitted with a tag, and wait() hands back (tag, TrialResult) pairs as trials finish,
+    #   in whatever order they finish.
+    def __init__(self, fuzzplan, nWorkers) :
+        self.fuzzplan = fuzzplan
+        self.capacity = nWorkers
+        self.timeout = fuzzplan.getFloatParam("trialTimeout")
+        self.poller = select.poll()
+        self.reading = dict() # fd -> EventTrial, for trials whose output hasn't ended yet
+        self.exiting = list() # EventTrials whose output has ended, but whose shell hasn't exited
+        self.waiting = collections.deque() # (script, tag) not started yet, for want of capacity
+        self.finished = list() # (tag, TrialResult) not yet handed back by wait()
+    def nStarted(self) : return len(self.reading) + len(self.exiting)
+    def hasRoom(self) : return self.nStarted() + len(self.waiting) < self.capacity
+    def submit(self, script, tag) :
+        self.waiting.append((script, tag))
+        self.startWaiting()
+    def startWaiting(self) :
+        while len(self.waiting) > 0 and self.nStarted() < self.capacity :
+            script, tag = self.waiting.popleft()
+            self.start(script, tag)
+    def start(self, script, tag) :
+        spawnStart = time.time()
+        child = subprocess.Popen(pipedShellCommand,stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                 stderr=devnull,close_fds=True,preexec_fn=self.fuzzplan.trialPreexec())
+        # Only a script too long for the pipe's buffer costs a writer thread; the rest never block the loop
+        feedScript(child.stdin, script)
+        trial = EventTrial()
+        trial.tag = tag
+        trial.child = child
+        trial.fd = child.stdout.fileno()
+        trial.parser = self.fuzzplan.newOutputParser()
+        trial.startTime = spawnStart
+        trial.deadline = spawnStart + self.timeout if self.timeout > 0 else None
+        trial.spawnTime = time.time() - spawnStart
+        self.poller.register(trial.fd, select.POLLIN)
+        self.reading[trial.fd] = trial
+    def endOutput(self, trial) :
+        self.poller.unregister(trial.fd)
+        del self.reading[trial.fd]
+        trial.child.stdout.close()
+        # The fd number may now be given to a newer trial, so this one mustn't go on using it
+        trial.fd = None
+    def finish(self, trial, stoppedEarly=False, timedOut=False) :
+        if trial.fd is not None : self.endOutput(trial)
+        if trial in self.exiting : self.exiting.remove(trial)
+        if stoppedEarly or timedOut :
+            try : os.killpg(trial.child.pid, signal.SIGKILL)
+            except OSError : pass
+        trial.child.wait()
+        status = None if stoppedEarly or timedOut else trial.child.returncode
+        result = trial.parser.finish(status, stoppedEarly, timedOut)
+        result.spawnTime = trial.spawnTime
+        result.runTime = time.time() - trial.startTime
+        self.finished.append((trial.tag, result))
+    def pollOnce(self) :
+        # Wait for output, for a shell to exit, or for the next deadline, whichever comes first
+        deadlines = [trial.deadline for trial in self.reading.values() + self.exiting if trial.deadline is not None]
+        timeout = None if len(deadlines) == 0 else max(0.0, min(deadlines) - time.time())
+        if len(self.exiting) > 0 : timeout = 0.01 if timeout is None else min(timeout, 0.01) # exits aren't polled for
+        for fd, event in self.poller.poll(None if timeout is None else int(math.ceil(1000 * timeout))) :
+            trial = self.reading[fd]
+            data = os.read(fd, readSize)
+            if data == "" :
+                self.endOutput(trial)
+                self.exiting.append(trial)
+            else :
+                trial.parser.feed(data)
+                # If we have every output value we need, don't wait for the rest of the trial
+                if trial.parser.isDone() : self.finish(trial, stoppedEarly=True)
+        for trial in list(self.exiting) :
+            if trial.child.poll() is not None : self.finish(trial)
+        now = time.time()
+        for trial in self.reading.values() + self.exiting :
+            if trial.deadline is not None and now >= trial.deadline : self.finish(trial, timedOut=True)
+    def wait(self) :
+        # Block until at least one trial has finished (unless none are running), and return
+        #   the (tag, TrialResult) of every trial that has
+        while len(self.finished) == 0 and self.nStarted() > 0 :
+            self.pollOnce()
+            self.startWaiting()
+        finished, self.finished = self.finished, list()
+        return finished
+    def runAll(self, scripts) :
+        results = [None] * len(scripts)
+        for i, script in enumerate(scripts) : self.submit(script, i)
+        while any(result is None for result in results) :
+            for i, result in self.wait() : results[i] = result
+        return results
+    def close(self) :
+        self.waiting.clear()
+        for trial in self.reading.values() + self.exiting : self.finish(trial, timedOut=True)
+        self.finished = list()
+
+class WorkerPool :
+    """This class hands out workers of one executor type to the trials that need them"""
+    def __init__(self, fuzzplan, nWorkers) :
+        executor = fuzzplan.getStringParam("executor")
+        if executor not in executorTypes : raise Exception("Unrecognized executor: " + executor)
+        if executor == "shell" and not ShellWorker.isAvailable() :
+            print "====== There is no setsid command for executor shell, so using executor popen instead"
+            executor = "popen"
+        self.workers = [executorTypes[executor](fuzzplan) for i in range(nWorkers)]
+        self.idle = Queue.Queue()
+        for worker in self.workers : self.idle.put(worker)
+        self.threadPool = None
+    def run(self, script) :
+        worker = self.idle.get()
+        try :
+            start = time.time()
+            result = worker.run(script)
+            result.runTime = time.time() - start
+            return result
+        finally : self.idle.put(worker)
+    def runAll(self, scripts) :
+        # Run the scripts, as many at a time as there are workers, and return their results in order
+        if len(self.workers) <= 1 or len(scripts) <= 1 : return [self.run(script) for script in scripts]
+        if self.threadPool is None : self.threadPool = ThreadPool(len(self.workers))
+        return self.threadPool.map(self.run, scripts)
+    def close(self) :
+        if self.threadPool is not None : self.threadPool.close()
+        self.threadPool = None
+        for worker in self.workers : worker.close()
+
+# Messages between a coordinator and its remote workers are JSON, each preceded by its length.
+#   Scripts and output can hold any bytes, so strings are sent as latin-1.
+def sendMessage(sock, message) :
+    data = json.dumps(message)
+    sock.sendall(struct.pack("!I", len(data)) + data)
+
+def receiveMessage(sockFile) :
+    header = sockFile.read(4)
+    if len(header) < 4 : return None
+    length = struct.unpack("!I", header)[0]
+    data = sockFile.read(length)
+    if len(data) < length : return None
+    return json.loads(data)
+
+def resultToMessage(taskId, result) :
+    return {"type" : "result", "id" : taskId, "stdout" : result.stdout.decode("latin-1"),
+            "status" : result.status, "truncated" : result.truncated, "stoppedEarly" : result.stoppedEarly,
+            "timedOut" : result.timedOut, "runTime" : result.runTime,
+            "outputValues" : dict((k, v.decode("latin-1")) for k, v in result.outputValues.items())}
+
+def resultFromMessage(message) :
+    outputValues = dict((str(k), v.encode("latin-1")) for k, v in message["outputValues"].items())
+    result = TrialResult(message["stdout"].encode("latin-1"), message["status"], outputValues,
+                         message["truncated"], message["stoppedEarly"], timedOut=message.get("timedOut", False))
+    result.runTime = message.get("runTime", 0.0) # as the worker measured it, without the network
+    return result
+
+class RemoteTask(object) :
+    """This class represents one script that the coordinator has been asked to run"""
+    __slots__ = ("taskId", "script", "results", "index", "attempts")
+    def __init__(self, taskId, script, results, index) :
+        self.taskId = taskId
+        self.script = script
+        self.results = results # the list that the result goes into, at position index
+        self.index = index
+        self.attempts = 0
+
+class RemoteConnection(object) :
+    """This class represents one connected remote worker, as seen by the coordinator"""
+    def __init__(self, sock, address) :
+        self.sock = sock
+        self.sockFile = sock.makefile("rb")
+        self.address = address
+        self.inFlight = dict() # taskId -> RemoteTask
+
+class Coordinator :
+    """This class hands scripts out to remote workers over TCP, and gathers their results"""
+    # Remote workers are started with "fuzzplan.py --worker HOST:PORT".  They may join and
+    #   leave at any time; a script that was in flight on a worker that leaves is retried elsewhere.
+    def __init__(self, fuzzplan) :
+        self.fuzzplan = fuzzplan
+        self.maxInFlight = fuzzplan.getIntParam("remoteMaxInFlight")
+        self.maxAttempts = fuzzplan.getIntParam("remoteRetries") + 1
+        self.condition = threading.Condition()
+        self.connections = list()
+        self.pending = collections.deque() # RemoteTasks waiting for a worker
+        self.nextTaskId = 0
+        self.closed = False
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((fuzzplan.getStringParam("coordinatorHost"), fuzzplan.getIntParam("coordinatorPort")))
+        self.listener.listen(16)
+        print "====== Waiting for remote workers on %s:%d" % self.listener.getsockname()
+        self.startThread(self.acceptLoop)
+    def startThread(self, target, *args) :
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+    def acceptLoop(self) :
+        while not self.closed :
+            try : sock, address = self.listener.accept()
+            except socket.error : return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = RemoteConnection(sock, address)
+            try :
+                # Tell the worker how to run scripts: it uses the same parameters as this plan
+                sendMessage(sock, {"type" : "hello", "parameters" : self.fuzzplan.parameters})
+            except socket.error :
+                continue
+            with self.condition :
+                self.connections.append(connection)
+                print "====== Remote worker joined from %s:%d" % address
+                self.dispatch()
+            self.startThread(self.receiveLoop, connection)
+    def receiveLoop(self, connection) :
+        while True :
+            try : message = receiveMessage(connection.sockFile)
+            except (socket.error, ValueError) : message = None
+            with self.condition :
+                if message is None :
+                    self.dropConnection(connection)
+                    return
+                if message["type"] == "result" and message["id"] in connection.inFlight :
+                    task = connection.inFlight.pop(message["id"])
+                    task.results[task.index] = resultFromMessage(message)
+                    self.dispatch()
+                    self.condition.notify_all()
+    def dropConnection(self, connection) :
+        # Called with self.condition held.  Anything the worker was running goes back in the queue.
+        if connection not in self.connections : return
+        self.connections.remove(connection)
+        try : connection.sock.close()
+        except socket.error : pass
+        if not self.closed : print "====== Remote worker at %s:%d left" % connection.address
+        for task in sorted(connection.inFlight.values(), key=lambda task : task.taskId, reverse=True) :
+            if task.attempts >= self.maxAttempts :
+                print "====== Giving up on a script after %d attempts" % task.attempts
+                task.results[task.index] = self.fuzzplan.newOutputParser().finish(None) # outcome "lost"
+            else : self.pending.appendleft(task)
+        connection.inFlight = dict()
+        self.dispatch()
+        self.condition.notify_all()
+    def dispatch(self) :
+        # Called with self.condition held.  Keep up to maxInFlight scripts running on each worker.
+        for connection in list(self.connections) :
+            while len(self.pending) > 0 and len(connection.inFlight) < self.maxInFlight :
+                task = self.pending.popleft()
+                task.attempts += 1
+                connection.inFlight[task.taskId] = task
+                try : sendMessage(connection.sock, {"type" : "run", "id" : task.taskId, "script" : task.script.decode("latin-1")})
+                except socket.error :
+                    self.dropConnection(connection)
+                    break
+    def runAll(self, scripts) :
+        results = [None] * len(scripts)
+        with self.condition :
+            for i, script in enumerate(scripts) :
+                self.pending.append(RemoteTask(self.nextTaskId, script, results, i))
+                self.nextTaskId += 1
+            self.dispatch()
+            while any(result is None for result in results) :
+                # Wait with a timeout, so that Ctrl-C still works
+                self.condition.wait(1.0)
+        return results
+    def close(self) :
+        with self.condition :
+            self.closed = True
+            for connection in list(self.connections) :
+                try : sendMessage(connection.sock, {"type" : "bye"})
+                except socket.error : pass
+                self.dropConnection(connection)
+        self.listener.close()
+
+def workerMain(address, nWorkers) :
+    # Run scripts on behalf of a coordinator until it says goodbye or goes away
+    host, port = address.rsplit(":", 1)
+    sock = socket.create_connection((host, int(port)))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sockFile = sock.makefile("rb")
+    hello = receiveMessage(sockFile)
+    if hello is None or hello["type"] != "hello" : raise Exception("No hello from the coordinator at " + address)
+    plan = Fuzzplan(None)
+    plan.parameters.update((str(k), v) for k, v in hello["parameters"].items())
+    plan.parameters["executor"] = plan.getStringParam("remoteWorkerExecutor")
+    if plan.getStringParam("executor") not in executorTypes :
+        raise Exception("Unrecognized remoteWorkerExecutor: " + plan.getStringParam("executor"))
+    plan.parameters["nWorkers"] = nWorkers if nWorkers is not None else plan.getIntParam("remoteMaxInFlight")
+    pool = plan.getWorkerPool()
+    threadPool = ThreadPool(plan.getIntParam("nWorkers"))
+    sendLock = threading.Lock()
+    def runOne(taskId, script) :
+        result = pool.run(script)
+        with sendLock :
+            try : sendMessage(sock, resultToMessage(taskId, result))
+            except socket.error : pass # the coordinator has gone; the receive loop will notice
+    print "====== Connected to coordinator at %s" % address
+    try :
+        while True :
+            message = receiveMessage(sockFile)
+            if message is None or message["type"] == "bye" : break
+            if message["type"] == "run" :
+                threadPool.apply_async(runOne, (message["id"], message["script"].encode("latin-1")))
+    finally :
+        threadPool.terminate()
+        plan.close()
+        sock.close()
+
+class MutationScheduler(object) :
+    """This class decides how each mutant is made, and learns which ways pay off for the plan"""
+    # Each arm is an (operator, head) choice: ("substitution", head) mutates a substitution
+    #   with that head, and (operator, None) applies one of CommandSequence.blockOperators.
+    # Scheduler "bandit" picks arms by Thompson sampling: each arm's chance of making a mutant
+    #   whose OBJECTIVE beats its parent's is modelled by a Beta distribution, whose counts are
+    #   multiplied by banditDiscount at every update, so that the scheduler keeps up as the
+    #   search moves on.  Scheduler "fixed" flips the fuzzProbMutateSubstitution coin instead.
+    def __init__(self, fuzzplan) :
+        self.fuzzplan = fuzzplan
+        self.kind = fuzzplan.getStringParam("scheduler")
+        if self.kind not in ("fixed", "bandit") : raise Exception("Unrecognized scheduler: " + self.kind)
+        operators = [operator for operator in fuzzplan.getStringParam("mutationOperators").split(";;") if len(operator) > 0]
+        for operator in operators :
+            if operator not in CommandSequence.blockOperators : raise Exception("Unrecognized mutation operator: " + operator)
+        heads = sorted(set(point.head for template in fuzzplan.templates for point in template.points))
+        self.arms = [("substitution", head) for head in heads] + [(operator, None) for operator in operators]
+        if len(self.arms) == 0 : self.arms = [("replace", None)]
+        self.successes = dict((arm, 0.0) for arm in self.arms)
+        self.failures = dict((arm, 0.0) for arm in self.arms)
+        self.tries = dict((arm, 0) for arm in self.arms)
+        self.discount = fuzzplan.getFloatParam("banditDiscount")
+        self.donors = list() # recent mutants that improved on their parents, for "splice"
+        self.rng = random.Random(hashlib.sha1(fuzzplan.getCampaignSeed() + "scheduler").hexdigest())
+    def mutate(self, sequence, label) :
+        # Mutate sequence in the way the scheduler picks.  Returns the undo record.
+        if self.kind == "fixed" :
+            # The sequence flips the coin itself, so plans mutate just as they did before there were schedulers
+            return sequence.mutateCommandSequence(label)
+        choice = max(self.arms, key=lambda arm : self.rng.betavariate(1.0 + self.successes[arm], 1.0 + self.failures[arm]))
+        donor = None
+        if choice[0] == "splice" and len(self.donors) > 0 : donor = self.rng.choice(self.donors)
+        return sequence.mutateCommandSequence(label, choice, donor)
+    def update(self, mutant, parentObjective, improved=None) :
+        # Credit the arm that made mutant with whether it improved on its parent: by default,
+        #   whether it beat its parent's objective
+        if improved is None :
+            objective = mutant.getObjective()
+            improved = objective is not None and (parentObjective is None or objective > parentObjective)
+        if improved :
+            self.donors.append(CommandSequence(orig=mutant)) # random mode goes on to mutate mutant itself
+            if len(self.donors) > self.fuzzplan.getIntParam("spliceDonors") : self.donors.pop(0)
+        arm = mutant.getChoice()
+        if arm not in self.tries : return # e.g. "fixed" made it, or it came from a cache
+        for other in self.arms :
+            self.successes[other] *= self.discount
+            self.failures[other] *= self.discount
+        self.tries[arm] += 1
+        if improved : self.successes[arm] += 1.0
+        else : self.failures[arm] += 1.0
+    def getState(self) :
+        # What a checkpoint needs to carry on with the same choices
+        return {"successes" : dict(self.successes), "failures" : dict(self.failures), "tries" : dict(self.tries),
+                "donors" : list(self.donors), "rng" : self.rng.getstate()}
+    def setState(self, state) :
+        for arm in self.arms :
+            if arm in state["tries"] :
+                self.successes[arm], self.failures[arm], self.tries[arm] = state["successes"][arm], state["failures"][arm], state["tries"][arm]
+        self.donors = list(state["donors"])
+        self.rng.setstate(state["rng"])
+    def report(self) :
+        if self.kind != "bandit" : return
+        print "====== Mutations tried (and recent success rate):"
+        for arm in self.arms :
+            rate = (1.0 + self.successes[arm]) / (2.0 + self.successes[arm] + self.failures[arm])
+            print "======   %-28s %8d  %.3f" % (arm[0] if arm[1] is None else "%s %s" % arm, self.tries[arm], rate)
+
+class FeedbackMap(object) :
+    """This class remembers which (key, bucketed value) pairs trials have printed, in a fixed-size bitmap"""
+    # As in coverage-guided fuzzers, each pair is hashed to one bit, so the map stays the same
+    #   size however long the campaign runs, and checking a trial costs one lookup per output
+    #   value.  A trial is novel if it sets a bit that no earlier trial has.  Numbers are
+    #   bucketed by sign and power of two, so that a count going from 5 to 6 isn't news but
+    #   one going from 5 to 500 is; any other value is hashed as it is.
+    def __init__(self, nBits, keys) :
+        self.nBits = nBits
+        self.bits = bytearray((nBits + 7) // 8)
+        self.keys = keys # the output values to look at; all of them if empty
+        self.nSet = 0
+    def bucket(self, value) :
+        try : number = float(value)
+        except ValueError : return value
+        if number == 0 or number != number : return str(number)
+        return "%s%d" % ("-" if number < 0 else "+", math.frexp(number)[1])
+    def add(self, outputValues) :
+        # Set the bits for a trial's output values; returns how many of them were new
+        nNew = 0
+        for key, value in outputValues.items() :
+            if len(self.keys) > 0 and key not in self.keys : continue
+            index = (zlib.crc32(key + "=" + self.bucket(value.strip())) & 0xffffffff) % self.nBits
+            mask = 1 << (index & 7)
+            if not self.bits[index >> 3] & mask :
+                self.bits[index >> 3] |= mask
+                nNew += 1
+        self.nSet += nNew
+        return nNew
+    def getState(self) : return str(self.bits)
+    def setState(self, bits) :
+        self.bits = bytearray(bits)
+        self.nSet = sum(bin(byte).count("1") for byte in self.bits)
+
+def fitness(sequence) :
+    # For sorting sequences by OBJECTIVE, with those that have none at the bottom
+    objective = sequence.getObjective()
+    return objective if objective is not None else float("-inf")
+
+def deltaDebug(items, areReproducing) :
+    # Find a small sublist of items that still reproduces, by the ddmin algorithm of Zeller
+    #   and Hildebrandt.  areReproducing takes a list of candidate sublists, which it may try
+    #   in parallel, and returns a list of booleans saying which of them reproduce.
+    if len(items) == 0 or areReproducing([[]])[0] : return []
+    n = 2
+    while len(items) >= 2 :
+        size = int(math.ceil(len(items) / float(n)))
+        chunks = [items[i:i+size] for i in range(0, len(items), size)]
+        complements = [items[:i] + items[i+size:] for i in range(0, len(items), size)]
+        candidates = chunks + complements if len(chunks) > 2 else chunks
+        reproducing = areReproducing(candidates)
+        if any(reproducing[:len(chunks)]) :
+            items = chunks[reproducing.index(True)]
+            n = 2
+        elif any(reproducing[len(chunks):]) :
+            items = complements[reproducing[len(chunks):].index(True)]
+            n = max(n - 1, 2)
+        elif n >= len(items) : break
+        else : n = min(2 * n, len(items))
+    return items
 
 class Fuzzplan :
     """This class represents a plan for how to fuzz the input to some application"""
     def __init__(self, planFilePath) :
         self.setDefaultParameters()
-        self.parsePlanFile(planFilePath)
+        self.planFilePath = os.path.abspath(planFilePath) if planFilePath is not None else None
+        if planFilePath is not None : self.parsePlanFile(planFilePath)
+        else : self.header, self.footer, self.bodyBlocks = list(), list(), list() # e.g. for a remote worker
+        self.bindSubstitutionPoints()
         self.commandBlocks = list()
+        self.workerPool = None
+        self.resultCache = None
+        self.trialArchive = None
+        self.campaignSeed = None
+        self.scheduler = None
+        self.checkpointer = None
+        self.resumeState = None # the loop's state from a checkpoint, to carry on from (see loadCheckpoint)
+        self.profiler = NullProfiler()
+    def __deepcopy__(self, memo) : return self # copies of sequences all share the one plan
     def setDefaultParameters(self) :
         self.parameters = dict()
         self.parameters["nCommands"] = 20
@@ -207,9 +1589,61 @@ class Fuzzplan :
         self.parameters["numeric.max"] = 1000000000
         self.parameters["alpha.len"] = 20
         self.parameters["alphanumeric.len"] = 20
-        self.parameters["mode"] = "random"
+        self.parameters["mode"] = "random" # or "guided", "annealing", "evolutionary", "feedback" or "minimize"
         self.parameters["nMutants"] = 5
-        self.parameters["fuzzProbMutateSubstitution"] = 0.5
+        self.parameters["nWorkers"] = 1 # how many trials may run at the same time
+        self.parameters["executor"] = "shell" # "shell" reuses long-lived shells (or is "popen" without setsid);
+                                              #   "popen" spawns one per trial; "remote" sends scripts to workers started with --worker;
+                                              #   "event" runs nWorkers at once from one thread;
+                                              #   "python" calls pythonEntryPoint for each command (see python_harness.py)
+        self.parameters["pythonEntryPoint"] = "" # for executor "python": module:function or path/to/file.py:function
+        self.parameters["pythonInterpreter"] = sys.executable # the interpreter that runs python_harness.py
+        self.parameters["pythonRestartEvery"] = 0 # restart the harness after this many trials; 0 for never
+        self.parameters["trialTimeout"] = 0.0 # seconds after which a trial is killed, with everything it started (0 for never)
+        self.parameters["trialCpuLimit"] = 0 # CPU seconds that each process of a trial may use (0 for no limit; not for "python")
+        self.parameters["trialMemoryLimit"] = 0 # megabytes of address space that each process of a trial may use (0 for no limit)
+        self.parameters["trialProcessLimit"] = 0 # the most processes the user may have, trials included (0 for no limit; root is exempt)
+        self.parameters["outcomeObjectives"] = "" # e.g. "timeout=100;;memory=50": the OBJECTIVE of trials that end that way
+        self.parameters["coordinatorHost"] = "127.0.0.1" # where executor "remote" listens for workers
+        self.parameters["coordinatorPort"] = 7070
+        self.parameters["remoteMaxInFlight"] = 2 # scripts outstanding at once on each remote worker
+        self.parameters["remoteRetries"] = 3 # times to retry a script whose worker went away
+        self.parameters["remoteWorkerExecutor"] = "shell" # how remote workers run the scripts they are sent
+        self.parameters["maxOutputBytes"] = 1048576 # how much of each trial's stdout to keep and print
+        self.parameters["stopAfterOutputs"] = "" # e.g. "OBJECTIVE": end each trial once these are printed (separate with ;;)
+        self.parameters["cacheSize"] = 0 # how many results of already-run scripts to remember in memory
+        self.parameters["cacheDir"] = "" # a directory in which to remember results across runs
+        self.parameters["cacheTTL"] = -1.0 # seconds until a remembered result goes stale; -1 for never
+        self.parameters["archiveDir"] = "" # a directory in which to archive every trial (read it with replay_fuzzplan.py)
+        self.parameters["checkpointFile"] = "" # a file to checkpoint the search to, so that it can be resumed with --resume
+        self.parameters["checkpointInterval"] = 100 # trials (generations, for mode evolutionary) between checkpoints
+        self.parameters["metricsFile"] = "" # a file to append per-trial timing metrics to, as JSON lines
+        self.parameters["metricsInterval"] = 0 # print a summary of the metrics every this many trials
+        self.parameters["fuzzProbMutateSubstitution"] = 0.5 # for scheduler "fixed"
+        self.parameters["scheduler"] = "fixed" # how mutations are picked: "fixed" flips the coin above; "bandit" learns which pay off
+        self.parameters["mutationOperators"] = "replace" # block operators for scheduler "bandit": any of replace;;insert;;delete;;swap;;duplicate;;splice
+        self.parameters["banditDiscount"] = 0.995 # how quickly scheduler "bandit" forgets old results
+        self.parameters["spliceDonors"] = 16 # how many improving mutants to keep as donors for "splice"
+        self.parameters["minCommands"] = 1 # the fewest body blocks that "delete" leaves
+        self.parameters["maxCommands"] = 0 # the most body blocks that "insert" etc. make; 0 for twice nCommands
+        self.parameters["seed"] = "" # the campaign seed; set it to make every trial reproducible
+        self.parameters["valuePoolSize"] = 256 # values generated per batch, for types with a _batch function; 0 for none
+        self.parameters["annealTmax"] = 25000.0 # starting temperature for mode annealing
+        self.parameters["annealTmin"] = 2.5 # final temperature for mode annealing
+        self.parameters["annealSteps"] = 50000 # trials over which to cool, when nTrials is -1
+        self.parameters["populationSize"] = 32 # for mode evolutionary (where each trial is a generation)
+        self.parameters["tournamentSize"] = 3 # how many members compete to be each parent
+        self.parameters["eliteCount"] = 2 # how many of the best members survive unchanged
+        self.parameters["crossoverProb"] = 0.7 # the chance that a child is a crossover of two parents
+        self.parameters["childMutationProb"] = 1.0 # the chance that a child is then mutated
+        self.parameters["raceBudget"] = 0 # for mode guided: extra runs per trial for telling noisy objectives apart; 0 for none
+        self.parameters["raceConfidence"] = 1.96 # standard errors either side of the mean objective that racing allows for
+        self.parameters["feedbackMapBits"] = 65536 # for mode feedback: the size of the map of output values seen
+        self.parameters["feedbackKeys"] = "" # the output values that mode feedback looks at (separate with ;;); all if empty
+        self.parameters["saveBestTo"] = "" # a file to save the best sequence so far to, for modes guided and annealing
+        self.parameters["minimizeInput"] = "" # for mode minimize: a sequence saved by saveBestTo
+        self.parameters["minimizeOutput"] = "" # where mode minimize writes the smallest script; default minimizeInput + ".min.sh"
+        self.parameters["minimizeTolerance"] = 0.0 # how far (as a fraction) the objective may fall while minimizing
         self.parameters["expr.binaryChars"] = "+-*/"
         self.parameters["expr.leaves"] = "@{numeric}" # separate with ;;
         self.parameters["expr.newProbLeaf"] = 0.6
@@ -225,13 +1659,212 @@ class Fuzzplan :
         if len(self.currentBodyBlock) > 0 :
             self.bodyBlocks.append(self.currentBodyBlock)
             self.currentBodyBlock = list()
-    def makeSubstitutionFromString(self, s) :
-        return newSubstitutionFromString(s, self)
+    def newOutputParser(self) :
+        stopAfterOutputs = [key for key in self.getStringParam("stopAfterOutputs").split(";;") if len(key) > 0]
+        outcomeObjectives = dict(pair.split("=", 1) for pair in self.getStringParam("outcomeObjectives").split(";;") if len(pair) > 0)
+        return OutputParser(self.getIntParam("maxOutputBytes"), stopAfterOutputs, self.getIntParam("trialMemoryLimit") > 0,
+                            outcomeObjectives)
+    def trialDeadline(self, start) :
+        # When a trial that started at start has run past trialTimeout, or None if it never does
+        if self.getFloatParam("trialTimeout") <= 0 : return None
+        return start + self.getFloatParam("trialTimeout")
+    def trialPreexec(self, cpu=True) :
+        # The preexec_fn for the shells (or harness) that run trials.  Each one leads its own
+        #   process group, so that it can be killed along with everything it started, and runs
+        #   under the plan's resource limits, which every process it starts inherits.  The CPU
+        #   limit is per process, and is left off for long-lived processes that run many trials.
+        limits = list()
+        if cpu and self.getIntParam("trialCpuLimit") > 0 :
+            # SIGXCPU at the soft limit, so that the outcome can be told apart from other kills
+            limits.append((resource.RLIMIT_CPU, self.getIntParam("trialCpuLimit"), self.getIntParam("trialCpuLimit") + 1))
+        if self.getIntParam("trialMemoryLimit") > 0 :
+            size = self.getIntParam("trialMemoryLimit") * 1024 * 1024
+            limits.append((resource.RLIMIT_AS, size, size))
+        if self.getIntParam("trialProcessLimit") > 0 :
+            limits.append((resource.RLIMIT_NPROC, self.getIntParam("trialProcessLimit"), self.getIntParam("trialProcessLimit")))
+        # A limit can't be raised past the hard limit that we run under ourselves
+        for i, (limit, soft, hard) in enumerate(limits) :
+            current = resource.getrlimit(limit)[1]
+            if current != resource.RLIM_INFINITY : limits[i] = (limit, min(soft, current), min(hard, current))
+        def preexec() :
+            os.setsid()
+            for limit, soft, hard in limits : resource.setrlimit(limit, (soft, hard))
+        return preexec
+    def getWorkerPool(self) :
+        if self.workerPool is None :
+            if self.getStringParam("executor") == "remote" : self.workerPool = Coordinator(self)
+            elif self.getStringParam("executor") == "event" :
+                self.workerPool = EventEngine(self, max(1, self.getIntParam("nWorkers")))
+            else : self.workerPool = WorkerPool(self, max(1, self.getIntParam("nWorkers")))
+        return self.workerPool
+    def getResultCache(self) :
+        if self.resultCache is None and (self.getIntParam("cacheSize") > 0 or len(self.getStringParam("cacheDir")) > 0) :
+            self.resultCache = ResultCache(self.getIntParam("cacheSize"), self.getStringParam("cacheDir"),
+                                           self.getFloatParam("cacheTTL"))
+        return self.resultCache
+    def getMaxCommands(self) :
+        if self.getIntParam("maxCommands") > 0 : return self.getIntParam("maxCommands")
+        return 2 * self.getIntParam("nCommands")
+    def getScheduler(self) :
+        if self.scheduler is None : self.scheduler = MutationScheduler(self)
+        return self.scheduler
+    def isSeeded(self) : return len(str(self.parameters["seed"])) > 0
+    def getCampaignSeed(self) :
+        # Every trial's randomness is derived from this.  Without a seed parameter, one is made
+        #   up (and printed, so that the run can be repeated, unless it uses value pools).
+        if self.campaignSeed is None :
+            if self.isSeeded() : self.campaignSeed = str(self.parameters["seed"])
+            else : self.campaignSeed = "%016x" % random.getrandbits(64)
+        return self.campaignSeed
+    def usesValuePools(self) :
+        # Whether any substitution point hands out values that weren't drawn from the trial's RNG
+        points = [point for template in self.templates for point in template.points] + self.compiledSubstitutionPoints.values()
+        return any(point.pool is not None for point in points)
+    def rebuildSequence(self, steps, getDonor=None) :
+        # Make the sequence that the campaign seed and these mutations lead to.  Each step is a
+        #   (label, choice, donor's trial number), and getDonor rebuilds a donor from its number.
+        sequence = CommandSequence(self)
+        for label, choice, donorId in steps :
+            sequence.mutateCommandSequence(label, choice, getDonor(donorId) if donorId is not None else None)
+        return sequence
+    def getCheckpointer(self) :
+        if self.checkpointer is None and len(self.getStringParam("checkpointFile")) > 0 :
+            self.checkpointer = Checkpointer(self, self.getStringParam("checkpointFile"), self.getIntParam("checkpointInterval"))
+        return self.checkpointer
+    def getTrialArchive(self) :
+        if self.trialArchive is None and len(self.getStringParam("archiveDir")) > 0 :
+            self.trialArchive = TrialArchive(self.getStringParam("archiveDir"))
+        return self.trialArchive
+    def runScripts(self, scripts) :
+        # Run several scripts, up to nWorkers of them at the same time, and return their
+        #   TrialResults in the same order.  Scripts whose results are in the cache aren't run,
+        #   and a script that appears more than once is only run once.
+        cache = self.getResultCache()
+        results = [None] * len(scripts)
+        toRun = collections.OrderedDict() # script -> indices of the results it will fill in
+        with self.profiler.phase("cache") :
+            for i, script in enumerate(scripts) :
+                if cache is not None : results[i] = cache.lookup(cache.key(script))
+                if results[i] is None : toRun.setdefault(script, []).append(i)
+        pool = self.getWorkerPool()
+        with self.profiler.phase("run") :
+            newResults = pool.runAll(list(toRun))
+        self.profiler.countExecutions(len(newResults))
+        for (script, indices), result in zip(toRun.items(), newResults) :
+            self.profiler.add("spawn", result.spawnTime)
+            self.profiler.add("parse", result.parseTime)
+            if cache is not None : cache.store(cache.key(script), result)
+            results[indices[0]] = result
+            for i in indices[1:] : results[i] = TrialResult("", result.status, dict(result.outputValues), cached=True)
+        return results
+    def executeAll(self, sequences) :
+        # Execute several sequences, running up to nWorkers of their scripts at the same time.
+        # Each script's output is parsed (and printed) in the order the sequences were given,
+        #   so the results are the same as executing them one after another.
+        with self.profiler.phase("render") :
+            scripts = [sequence.render() for sequence in sequences]
+        results = self.runScripts(scripts)
+        for sequence, result in zip(sequences, results) :
+            sequence.recordResult(result)
+    def close(self) :
+        # Shut down any worker processes that are still around
+        if self.workerPool is not None : self.workerPool.close()
+        self.workerPool = None
+        # The checkpointer and archive raise here if their writer threads failed, once both are closed
+        checkpointer, self.checkpointer = self.checkpointer, None
+        trialArchive, self.trialArchive = self.trialArchive, None
+        try :
+            if checkpointer is not None : checkpointer.close() # waits for the last checkpoint to be written
+        finally :
+            try :
+                if trialArchive is not None : trialArchive.close() # waits for the last trials to be written
+            finally : self.profiler.close()
+    def compileSubstitutionPoint(self, s) :
+        # Substitution points that are built from strings at run time (such as the leaves
+        #   of an expr) are parsed only the first time each string is seen
+        if s not in self.compiledSubstitutionPoints :
+            point = SubstitutionPoint(re.match(subPointRegex,s).group(1))
+            self.compiledSubstitutionPoints[s] = point
+            self.persistentIds[id(point)] = ("label", s)
+            point.bind(self)
+        return self.compiledSubstitutionPoints[s]
+    def getSubstitutionType(self, head) :
+        if head not in self.substitutionTypes :
+            self.substitutionTypes[head] = SubstitutionType(head, self)
+        return self.substitutionTypes[head]
+    def bindSubstitutionPoints(self) :
+        # Build the registry of substitution types used by this plan
+        self.substitutionTypes = dict()
+        # Points compiled from strings are bound to the types, so they are compiled afresh too
+        self.compiledSubstitutionPoints = dict()
+        self.templates = self.header + self.footer + sum(self.bodyBlocks, [])
+        # When a sequence is saved, the templates and points it uses are saved as these references
+        self.persistentIds = dict()
+        for iTemplate, template in enumerate(self.templates) :
+            self.persistentIds[id(template)] = ("template", iTemplate, template.string)
+            for iPoint, point in enumerate(template.points) :
+                self.persistentIds[id(point)] = ("point", iTemplate, template.string, iPoint)
+        for template in self.templates :
+            for point in template.points : point.bind(self)
+    def persistentId(self, obj) :
+        # The plan, its templates and its substitution points aren't saved along with a
+        #   sequence; they are saved as references into the plan file, and looked up on loading
+        if obj is self : return "plan"
+        if isinstance(obj, (CompiledTemplate, SubstitutionPoint)) : return self.persistentIds[id(obj)]
+        return None
+    def persistentLoad(self, persistentId) :
+        if persistentId == "plan" : return self
+        if persistentId[0] == "label" : return self.compileSubstitutionPoint(persistentId[1])
+        iTemplate, string = persistentId[1], persistentId[2]
+        if iTemplate >= len(self.templates) or self.templates[iTemplate].string != string :
+            raise Exception("The saved sequence was made from a different plan file")
+        if persistentId[0] == "template" : return self.templates[iTemplate]
+        return self.templates[iTemplate].points[persistentId[3]]
+    def saveSequence(self, path, sequence, objective=None) :
+        # Write to a temporary file first, so that a crash can't leave a half-written file behind
+        with open(path + ".tmp", "wb") as saveFile :
+            pickler = cPickle.Pickler(saveFile, 2)
+            pickler.persistent_id = self.persistentId
+            pickler.dump({"sequence" : sequence, "objective" : objective})
+        os.rename(path + ".tmp", path)
+    def loadSequence(self, path) :
+        with open(path, "rb") as saveFile :
+            unpickler = cPickle.Unpickler(saveFile)
+            unpickler.persistent_load = self.persistentLoad
+            return unpickler.load()["sequence"]
+    def captureState(self, iTrial, sequence, population, **loopState) :
+        # Snapshot the fuzzing loop after trial iTrial, for the Checkpointer to write.  Since
+        #   sequences are copy-on-write, copying the sequence objects themselves (which the loop
+        #   goes on to change) is enough to freeze everything, even for a large population.
+        state = dict(loopState)
+        state["mode"] = self.getStringParam("mode")
+        state["iTrial"] = iTrial
+        state["sequence"] = CommandSequence(orig=sequence)
+        if population is not None : state["population"] = [CommandSequence(orig=member) for member in population]
+        else : state["population"] = None
+        state["scheduler"] = self.getScheduler().getState()
+        header = {"planFile" : self.planFilePath, "parameters" : dict(self.parameters), "campaignSeed" : self.getCampaignSeed()}
+        return header, state
+    def writeCheckpoint(self, path, header, state) :
+        # The header is pickled first, since the plan must be loaded before the state can be
+        #   (see loadCheckpoint).  Both use the same references into the plan file as saveSequence.
+        buffer = cStringIO.StringIO()
+        pickler = cPickle.Pickler(buffer, 2)
+        pickler.persistent_id = self.persistentId
+        pickler.dump(header)
+        pickler.dump(state)
+        with open(path + ".tmp", "wb") as checkpointFile :
+            checkpointFile.write(zlib.compress(buffer.getvalue(), 1))
+            checkpointFile.flush()
+            os.fsync(checkpointFile.fileno())
+        os.rename(path + ".tmp", path)
+    def makeSubstitutionFromString(self, s, rng) :
+        return newSubstitutionFromString(s, self, rng)
     def parsePlanFile(self, planFilePath) :
         with open(planFilePath,"r") as commandFile :
-            self.header = list() # this is a list of strings
-            self.footer = list() # this is a list of strings
-            self.bodyBlocks = list() # this is a list of lists of strings
+            self.header = list() # this is a list of CompiledTemplates
+            self.footer = list() # this is a list of CompiledTemplates
+            self.bodyBlocks = list() # this is a list of lists of CompiledTemplates
             self.currentBodyBlock = list()
             mode = "##body"
             for line in commandFile :
@@ -251,50 +1884,393 @@ class Fuzzplan :
                                   }[parts[0].strip()]
                         self.parameters[parts[1]] = convert(parts[2].strip())
                     else : raise Exception("Malformed ##param line")
-                elif mode == "##header" : self.header.append(line)
-                elif mode == "##footer" : self.footer.append(line)
+                elif mode == "##header" : self.header.append(CompiledTemplate(line))
+                elif mode == "##footer" : self.footer.append(CompiledTemplate(line))
                 else :
                     if len(sline) == 0 : self.closeBlock()
-                    else: self.currentBodyBlock.append(line)
+                    else: self.currentBodyBlock.append(CompiledTemplate(line))
             self.closeBlock()
+    def getTemperature(self, iTrial) :
+        # Cool exponentially from annealTmax to annealTmin over the course of the run
+        nSteps = self.getIntParam("nTrials")
+        if nSteps <= 0 : nSteps = self.getIntParam("annealSteps")
+        Tmax = self.getFloatParam("annealTmax")
+        Tmin = self.getFloatParam("annealTmin")
+        return Tmax * math.exp(math.log(Tmin / Tmax) * min(1.0, float(iTrial) / nSteps))
+    def runCandidates(self, candidates, threshold) :
+        # Run candidate sequences in parallel, without printing them, and return which of them
+        #   still reach the threshold objective
+        results = self.runScripts([candidate.render() for candidate in candidates])
+        reproducing = list()
+        for candidate, result in zip(candidates, results) :
+            candidate.exitStatus = result.status
+            candidate.outputValues = result.outputValues
+            objective = candidate.getObjective()
+            reproducing.append(objective is not None and objective >= threshold)
+        return reproducing
+    def minimize(self) :
+        # Shrink a saved sequence while its objective stays within minimizeTolerance of what
+        #   it was: first drop as many body blocks as possible, then set as many substitutions
+        #   as possible to their simplest values
+        inputPath = self.getStringParam("minimizeInput")
+        outputPath = self.getStringParam("minimizeOutput")
+        if len(outputPath) == 0 : outputPath = inputPath + ".min.sh"
+        sequence = self.loadSequence(inputPath)
+        print "======== Original sequence"
+        sequence.execute()
+        objective = sequence.getObjective()
+        if objective is None : raise Exception("The saved sequence doesn't report an OBJECTIVE")
+        threshold = objective - self.getFloatParam("minimizeTolerance") * abs(objective)
+        print "======== Minimizing while OBJECTIVE >= %s" % threshold
+        header, body, footer = sequence.commandBlocks[0], sequence.commandBlocks[1:-1], sequence.commandBlocks[-1]
+        def withBlocks(kept) :
+            candidate = CommandSequence(orig=sequence)
+            candidate.setCommandBlocks((header,) + tuple(body[i] for i in kept) + (footer,))
+            return candidate
+        kept = deltaDebug(range(len(body)),
+                          lambda keptLists : self.runCandidates([withBlocks(kept) for kept in keptLists], threshold))
+        sequence = withBlocks(kept)
+        print "======== Kept %d of %d body blocks" % (len(kept), len(body))
+        # Every substitution whose value isn't already its simplest one
+        simplest = collections.OrderedDict() # (iBlock, iCommand, iSub) -> simplest value
+        for iBlock, block in enumerate(sequence.commandBlocks) :
+            for iCommand, command in enumerate(block.commands) :
+                for iSub, sub in enumerate(command.getSubs()) :
+                    value = sub.point.simplest(self)
+                    if value != sub.getOutput() : simplest[(iBlock, iCommand, iSub)] = value
+        def withSimplest(kept) :
+            # Everything in simplest that isn't in kept gets its simplest value
+            replaced = dict((position, value) for position, value in simplest.items() if position not in set(kept))
+            blocks = list(sequence.commandBlocks)
+            for iBlock, block in enumerate(blocks) :
+                commands = list(block.commands)
+                for iCommand, command in enumerate(commands) :
+                    subs = list(command.getSubs())
+                    for iSub, sub in enumerate(subs) :
+                        if (iBlock, iCommand, iSub) in replaced :
+                            subs[iSub] = Substitution(orig=sub)
+                            subs[iSub].setOutput(replaced[(iBlock, iCommand, iSub)])
+                    if subs != list(command.getSubs()) :
+                        commands[iCommand] = CommandTemplate(orig=command)
+                        commands[iCommand].setSubs(tuple(subs))
+                if commands != list(block.commands) : blocks[iBlock] = CommandBlock(tuple(commands))
+            candidate = CommandSequence(orig=sequence)
+            candidate.setCommandBlocks(tuple(blocks))
+            return candidate
+        kept = deltaDebug(list(simplest),
+                          lambda keptLists : self.runCandidates([withSimplest(kept) for kept in keptLists], threshold))
+        sequence = withSimplest(kept)
+        print "======== Kept %d of %d substitution values" % (len(kept), len(simplest))
+        print "======== Minimized sequence"
+        sequence.execute()
+        with open(outputPath, "w") as outputFile : outputFile.write(sequence.render())
+        print "====== Wrote the minimized script to %s" % outputPath
+    def race(self, incumbent, candidates) :
+        # For mode guided with a raceBudget: pick the best of the incumbent and its mutants when
+        #   the objective is noisy, by their mean objective over repeated runs.  Each round drops
+        #   every sequence whose confidence interval lies wholly below that of the best one so
+        #   far, and runs the rest once more.  The race ends when one is left (the winner is clear),
+        #   or when the budget can't pay for another round.  Sequences keep their objectiveStats,
+        #   so an incumbent that survives goes into the next race with all of its runs so far.
+        alive = [sequence for sequence in [incumbent] + candidates if sequence.objectiveStats is not None]
+        if len(alive) == 0 : return incumbent
+        z = self.getFloatParam("raceConfidence")
+        budget = self.getIntParam("raceBudget")
+        def mean(sequence) : return sequence.objectiveStats[1]
+        while True :
+            # A sequence that has run only once is taken to be as noisy as the others are on average
+            variances = [m2 / (n - 1) for n, m, m2 in (sequence.objectiveStats for sequence in alive) if n >= 2]
+            pooled = sum(variances) / len(variances) if len(variances) > 0 else None
+            def bounds(sequence) :
+                n, m, m2 = sequence.objectiveStats
+                variance = m2 / (n - 1) if n >= 2 else pooled
+                if variance is None : return float("-inf"), float("inf")
+                halfWidth = z * math.sqrt(variance / n)
+                return m - halfWidth, m + halfWidth
+            best = max(alive, key=mean)
+            floor = bounds(best)[0]
+            alive = [sequence for sequence in alive if sequence is best or bounds(sequence)[1] >= floor]
+            if len(alive) == 1 or len(alive) > budget : break
+            budget -= len(alive)
+            print "======== Racing %d sequences again (%d runs left)" % (len(alive), budget)
+            # These runs only add to the statistics, so they skip the cache and aren't printed
+            with self.profiler.phase("run") :
+                results = self.getWorkerPool().runAll([sequence.render() for sequence in alive])
+            self.profiler.countExecutions(len(results))
+            for sequence, result in zip(alive, results) : sequence.addObjectiveSample(objectiveOf(result.outputValues))
+        best = max(alive, key=mean)
+        print "======== Race won with a mean objective of %s over %d runs" % (mean(best), best.objectiveStats[0])
+        return best
+    def nextGeneration(self, population, iGeneration, rng, scheduler) :
+        # For mode evolutionary: the best eliteCount members carry over as they are, and the rest
+        #   of the next generation are children of parents picked by tournament.  Each child is
+        #   a crossover of two parents (with probability crossoverProb) or a copy of one, and
+        #   is then mutated (with probability childMutationProb).  All of the children are run
+        #   as one batch; the elites aren't run again.
+        def tournament() :
+            return max((rng.choice(population) for i in range(self.getIntParam("tournamentSize"))), key=fitness)
+        elites = population[:self.getIntParam("eliteCount")]
+        children = list()
+        for iChild in range(self.getIntParam("populationSize") - len(elites)) :
+            parent = tournament()
+            with self.profiler.phase("clone") :
+                child = CommandSequence(orig=parent)
+            if rng.random() < self.getFloatParam("crossoverProb") :
+                child.mutateCommandSequence((iGeneration, iChild, "crossover"), ("crossover", None), tournament())
+            if rng.random() < self.getFloatParam("childMutationProb") : scheduler.mutate(child, (iGeneration, iChild))
+            children.append((child, parent.getObjective()))
+        self.executeAll([child for child, parentObjective in children])
+        for child, parentObjective in children : scheduler.update(child, parentObjective)
+        return elites + [child for child, parentObjective in children]
+    def runStreaming(self, sequence, iSubmitted=0, lastObjective=None) :
+        # Random mode on the event executor.  Up to nWorkers trials run at once, and the next
+        #   mutants are made while they run.  Each trial is printed as soon as it finishes, so
+        #   the trial numbers may come out of order.
+        # A checkpoint holds the latest trial submitted, so on resuming, the trials that were
+        #   still running when it was taken are not run again.
+        engine = self.getWorkerPool()
+        cache = self.getResultCache()
+        scheduler = self.getScheduler()
+        checkpointer = self.getCheckpointer()
+        nTrials = self.getIntParam("nTrials")
+        nFinished = 0
+        # lastObjective is that of the trial that finished most recently
+        while True :
+            ready = list() # (trial number, sequence, TrialResult) to be printed
+            while engine.hasRoom() and len(ready) < engine.capacity and (nTrials <= 0 or iSubmitted < nTrials) :
+                iSubmitted += 1
+                with self.profiler.phase("clone") :
+                    sequence = CommandSequence(orig=sequence) # the running trial keeps its own copy
+                scheduler.mutate(sequence, iSubmitted)
+                with self.profiler.phase("render") :
+                    script = sequence.render()
+                result = None
+                if cache is not None :
+                    with self.profiler.phase("cache") :
+                        result = cache.lookup(cache.key(script))
+                if result is not None : ready.append((iSubmitted, sequence, result, lastObjective))
+                else : engine.submit(script, (iSubmitted, sequence, script, lastObjective))
+            if len(ready) == 0 :
+                with self.profiler.phase("run") :
+                    done = engine.wait()
+                self.profiler.countExecutions(len(done))
+                for (iTrial, mutant, script, parentObjective), result in done :
+                    self.profiler.add("spawn", result.spawnTime)
+                    self.profiler.add("parse", result.parseTime)
+                    if cache is not None : cache.store(cache.key(script), result)
+                    ready.append((iTrial, mutant, result, parentObjective))
+            if len(ready) == 0 : break # nothing is running, and there is nothing left to run
+            for iTrial, mutant, result, parentObjective in ready :
+                print "======== TRIAL %d" % iTrial
+                mutant.recordResult(result)
+                scheduler.update(mutant, parentObjective)
+                lastObjective = mutant.getObjective()
+                nFinished += 1
+                self.profiler.endTrial(nFinished) # counted in the order trials finish
+                if checkpointer is not None and checkpointer.isDue(nFinished) :
+                    checkpointer.save(self.captureState(iSubmitted, sequence, None, lastObjective=lastObjective))
+        if checkpointer is not None : checkpointer.save(self.captureState(iSubmitted, sequence, None, lastObjective=lastObjective))
+        scheduler.report()
     def run(self) :
+        if len(self.getStringParam("metricsFile")) > 0 or self.getIntParam("metricsInterval") > 0 :
+            self.profiler = Profiler(self.getStringParam("metricsFile"), self.getIntParam("metricsInterval"))
+        if self.getStringParam("mode") == "minimize" :
+            self.minimize()
+            return
+        if self.usesValuePools() :
+            print "====== Campaign seed: %s (but value pools make this run unrepeatable; set ##stringparam seed for a repeatable one)" % self.getCampaignSeed()
+        else : print "====== Campaign seed: %s" % self.getCampaignSeed()
+        # The choices the fuzzing loop itself makes (e.g. annealing's) come from the seed too
+        loopRng = random.Random(hashlib.sha1(self.getCampaignSeed() + "loop").hexdigest())
         sequence = CommandSequence(self)
+        scheduler = self.getScheduler()
+        population = None # for mode evolutionary, sorted best first; for mode feedback, the queue of novel sequences
+        feedback = FeedbackMap(self.getIntParam("feedbackMapBits"),
+                               set(key for key in self.getStringParam("feedbackKeys").split(";;") if len(key) > 0))
+        bestObjective = None # for mode evolutionary
+        annealingStarted = False
+        currentEnergy = None # for mode annealing: the energy of sequence, once it has been run
+        bestEnergy = None
         iTrial = 1
+        state = self.resumeState
+        if state is not None :
+            # Carry on from a checkpoint, with everything as it was after its trial
+            if state["mode"] != self.getStringParam("mode") :
+                raise Exception("The checkpoint was written by a run in mode " + state["mode"])
+            sequence, population, bestObjective = state["sequence"], state["population"], state.get("bestObjective")
+            annealingStarted, currentEnergy, bestEnergy = state.get("annealingStarted"), state.get("currentEnergy"), state.get("bestEnergy")
+            if "loopRng" in state : loopRng.setstate(state["loopRng"])
+            if "feedbackMap" in state : feedback.setState(state["feedbackMap"])
+            scheduler.setState(state["scheduler"])
+            iTrial = state["iTrial"] + 1
+            print "====== Resuming after trial %d" % state["iTrial"]
+            if self.getIntParam("nTrials") > 0 and iTrial > self.getIntParam("nTrials") :
+                print "====== (all %d trials were already run)" % self.getIntParam("nTrials")
+                return
+        checkpointer = self.getCheckpointer()
+        def checkpoint() :
+            checkpointer.save(self.captureState(iTrial, sequence, population, bestObjective=bestObjective,
+                                                annealingStarted=annealingStarted, currentEnergy=currentEnergy,
+                                                bestEnergy=bestEnergy, loopRng=loopRng.getstate(),
+                                                feedbackMap=feedback.getState()))
         print "====== Executing fuzzing plan"
+        if self.getStringParam("mode") == "random" and self.getStringParam("executor") == "event" :
+            if state is not None : self.runStreaming(sequence, state["iTrial"], state.get("lastObjective"))
+            else : self.runStreaming(sequence)
+            return
         while True :
             print "======== TRIAL %d" % iTrial
             if self.getStringParam("mode") == "random" :
-                sequence.mutateCommandSequence()
+                parentObjective = sequence.getObjective()
+                scheduler.mutate(sequence, iTrial)
                 sequence.execute()
+                scheduler.update(sequence, parentObjective)
             elif self.getStringParam("mode") == "guided" :
-                bestMutant = sequence
-                bestObjective = sequence.getOutputValue("OBJECTIVE")
+                mutants = list()
                 for iMutant in range(self.getIntParam("nMutants")) :
-                    mutant = CommandSequence(orig=sequence) # copy our sequence
-                    mutant.mutateCommandSequence()
-                    mutant.execute()
-                    objective = mutant.getOutputValue("OBJECTIVE")
-                    try :
-                        if bestObjective is None or float(objective.strip()) > float(bestObjective.strip()) :
-                            bestMutant = mutant
-                            bestObjective = objective
-                    except : pass # in case a weird objective value was returned
+                    with self.profiler.phase("clone") :
+                        mutant = CommandSequence(orig=sequence) # copy our sequence
+                    scheduler.mutate(mutant, (iTrial, iMutant))
+                    mutants.append(mutant)
+                # The mutants are independent of one another, so they may be run in parallel
+                self.executeAll(mutants)
+                for mutant in mutants : scheduler.update(mutant, sequence.getObjective())
+                if self.getIntParam("raceBudget") > 0 :
+                    bestMutant = self.race(sequence, mutants)
+                    bestObjective = bestMutant.objectiveStats[1] if bestMutant.objectiveStats is not None else None
+                else :
+                    bestMutant = sequence
+                    bestObjective = sequence.getOutputValue("OBJECTIVE")
+                    for mutant in mutants :
+                        objective = mutant.getOutputValue("OBJECTIVE")
+                        try :
+                            if bestObjective is None or float(objective.strip()) > float(bestObjective.strip()) :
+                                bestMutant = mutant
+                                bestObjective = objective
+                        except : pass # in case a weird objective value was returned
+                if bestMutant is not sequence and len(self.getStringParam("saveBestTo")) > 0 :
+                    self.saveSequence(self.getStringParam("saveBestTo"), bestMutant, bestObjective)
                 sequence = bestMutant
+            elif self.getStringParam("mode") == "evolutionary" :
+                if population is None :
+                    # The first generation is the starting sequence and random restarts of it
+                    population = [sequence]
+                    for iMember in range(1, self.getIntParam("populationSize")) :
+                        member = CommandSequence(orig=sequence)
+                        member.mutateCommandSequence(("init", iMember), ("randomize", None))
+                        population.append(member)
+                    self.executeAll(population)
+                else :
+                    population = self.nextGeneration(population, iTrial, loopRng, scheduler)
+                population.sort(key=fitness, reverse=True)
+                best = population[0].getObjective()
+                if best is not None and (bestObjective is None or best > bestObjective) :
+                    bestObjective = best
+                    print "======== New best objective: %s" % bestObjective
+                    if len(self.getStringParam("saveBestTo")) > 0 :
+                        self.saveSequence(self.getStringParam("saveBestTo"), population[0], bestObjective)
+            elif self.getStringParam("mode") == "feedback" :
+                # Every sequence that makes the scripts print something new (see FeedbackMap) is
+                #   queued, and each trial mutates the next sequence in the queue, round robin
+                if population is None :
+                    # The first trial just fills in the map for the starting sequence
+                    sequence.execute()
+                    feedback.add(sequence.outputValues)
+                    population = [sequence]
+                else :
+                    parent = population[(iTrial - 2) % len(population)]
+                    mutants = list()
+                    for iMutant in range(self.getIntParam("nMutants")) :
+                        with self.profiler.phase("clone") :
+                            mutant = CommandSequence(orig=parent)
+                        scheduler.mutate(mutant, (iTrial, iMutant))
+                        mutants.append(mutant)
+                    self.executeAll(mutants)
+                    for mutant in mutants :
+                        nNew = feedback.add(mutant.outputValues)
+                        scheduler.update(mutant, parent.getObjective(), nNew > 0)
+                        if nNew > 0 :
+                            population.append(mutant)
+                            print "======== New feedback: %d new bits (%d sequences queued)" % (nNew, len(population))
+            elif self.getStringParam("mode") == "annealing" :
+                # The energy is minus the objective, so annealing looks for a high OBJECTIVE
+                if not annealingStarted :
+                    # The first trial just finds out the energy of the starting sequence
+                    sequence.execute()
+                    energy = sequence.getObjective()
+                    if energy is not None : currentEnergy = bestEnergy = -energy
+                    annealingStarted = True
+                else :
+                    undo = scheduler.mutate(sequence, iTrial)
+                    sequence.execute()
+                    scheduler.update(sequence, -currentEnergy if currentEnergy is not None else None)
+                    energy = sequence.getObjective()
+                    if energy is not None : energy = -energy
+                    T = self.getTemperature(iTrial)
+                    # Until some sequence has produced a usable objective, every move is accepted
+                    if currentEnergy is None or (energy is not None and (energy <= currentEnergy or
+                                                 loopRng.random() < math.exp((currentEnergy - energy) / T))) :
+                        currentEnergy = energy
+                        if energy is not None and (bestEnergy is None or energy < bestEnergy) :
+                            bestEnergy = energy
+                            print "======== New best objective: %s" % -bestEnergy
+                            if len(self.getStringParam("saveBestTo")) > 0 :
+                                self.saveSequence(self.getStringParam("saveBestTo"), sequence, -bestEnergy)
+                    else :
+                        # Rejected, so put the sequence back; its energy is still currentEnergy
+                        sequence.undoMutation(undo)
             else :
                 raise Exception("Unrecognized mode: " + self.getStringParam("mode"))
-            # Could add an annealing mode here...
 
+            self.profiler.endTrial(iTrial)
+            if checkpointer is not None and checkpointer.isDue(iTrial) : checkpoint()
             if iTrial == self.getIntParam("nTrials") : break
             iTrial += 1
+        if checkpointer is not None and not checkpointer.isDue(iTrial) : checkpoint()
+        if self.getStringParam("mode") == "feedback" :
+            print "====== Feedback map: %d of %d bits set, %d sequences queued" % (feedback.nSet, feedback.nBits, len(population))
+        scheduler.report()
 
-def usage() : print "USAGE: %s <fuzzing_plan_file>"
+def loadCheckpoint(checkpointPath, planFilePath=None) :
+    # Make the Fuzzplan that wrote a checkpoint, ready for run() to carry on where it left off.
+    #   By default the plan file and parameters are the ones the run had; planFilePath gives
+    #   another plan file (e.g. with a bigger nTrials), whose templates must be the same.
+    with open(checkpointPath, "rb") as checkpointFile :
+        unpickler = cPickle.Unpickler(cStringIO.StringIO(zlib.decompress(checkpointFile.read())))
+    header = unpickler.load()
+    fuzzplan = Fuzzplan(planFilePath if planFilePath is not None else header["planFile"])
+    if planFilePath is None :
+        fuzzplan.parameters = header["parameters"]
+        fuzzplan.bindSubstitutionPoints() # again, with the parameters the run had
+    fuzzplan.campaignSeed = header["campaignSeed"]
+    unpickler.persistent_load = fuzzplan.persistentLoad
+    fuzzplan.resumeState = unpickler.load()
+    return fuzzplan
+
+def usage() :
+    print "USAGE: %s <fuzzing_plan_file>" % sys.argv[0]
+    print "       %s --resume <checkpoint_file> [<fuzzing_plan_file>]" % sys.argv[0]
+    print "       %s --worker <coordinator_host>:<port> [<nWorkers>]" % sys.argv[0]
 
 def main() :
     if len(sys.argv) < 2 :
         usage()
         sys.exit(0)
-    planFilePath = sys.argv[1]
-    fuzzplan = Fuzzplan(planFilePath)
-    fuzzplan.run()
+    if sys.argv[1] == "--worker" :
+        if len(sys.argv) < 3 :
+            usage()
+            sys.exit(0)
+        workerMain(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else None)
+        return
+    if sys.argv[1] == "--resume" :
+        if len(sys.argv) < 3 :
+            usage()
+            sys.exit(0)
+        fuzzplan = loadCheckpoint(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else :
+        planFilePath = sys.argv[1]
+        fuzzplan = Fuzzplan(planFilePath)
+    try : fuzzplan.run()
+    finally : fuzzplan.close()
 
 if __name__=="__main__" : main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# The long-lived process behind "##stringparam executor python".  It imports the plan's
+#   pythonEntryPoint once, and then, for each trial script that fuzzplan.py sends it, calls
+#   the entry point with each line of the script in turn.
+#
+# USAGE: python_harness.py <module>:<function> [<maxOutputBytes>]
+#    or  python_harness.py <path/to/file.py>:<function> [<maxOutputBytes>]
+#
+# The entry point is called with one rendered command (a string) at a time.  Whatever it
+#   prints becomes the trial's stdout.  It may also return a string, which is printed, or a
+#   dict, whose items are printed as KEY:=value output values.  An exception ends only that
+#   command, and gives the trial an exit status of 1.  Only the first maxOutputBytes of what
+#   it prints are kept (all of it, if that isn't given); after that, only the latest KEY:=value line
+#   for each key is, so that a chatty target can't run the harness out of memory.
+#
+# Each request is a 4-byte big-endian length followed by the script.  Each reply is a
+#   4-byte big-endian exit status, a byte that is 1 if the output was cut short, and a
+#   4-byte big-endian length, followed by what was printed.
+import sys, os, re, struct, imp, traceback, collections
+
+outputValueRegex = re.compile("([A-Z0-9_]+):=") # as in fuzzplan.py
+maxLineLength = 65536
+
+class CappedOutput(object) :
+    """This class stands in for sys.stdout, keeping the start of what is printed and the output values after it"""
+    def __init__(self, maxBytes) :
+        self.maxBytes = maxBytes
+        self.kept = list()
+        self.nKept = 0
+        self.truncated = False
+        self.partial = "" # the start of the line being printed, once the output has been cut short
+        self.laterValues = collections.OrderedDict() # key -> its latest line, once the output has been cut short
+    def write(self, data) :
+        if isinstance(data, unicode) : data = data.encode("utf-8")
+        room = self.maxBytes - self.nKept if self.maxBytes is not None else len(data)
+        if room > 0 :
+            self.kept.append(data[:room])
+            self.nKept += min(room, len(data))
+        if len(data) > room :
+            if not self.truncated :
+                # The line that was cut short may still turn out to be an output value
+                self.truncated = True
+                kept = "".join(self.kept)
+                self.partial = kept[kept.rfind("\n")+1:][:maxLineLength]
+            self.scanLines(data[room:])
+    def scanLines(self, data) :
+        pieces = data.split("\n")
+        for piece in pieces[:-1] :
+            self.endLine(self.partial + piece[:maxLineLength - len(self.partial)])
+            self.partial = ""
+        self.partial += pieces[-1][:maxLineLength - len(self.partial)]
+    def endLine(self, line) :
+        matches = outputValueRegex.match(line)
+        if matches :
+            self.laterValues.pop(matches.group(1), None)
+            self.laterValues[matches.group(1)] = line
+    def flush(self) : pass
+    def getvalue(self) :
+        if self.truncated and len(self.partial) > 0 : self.endLine(self.partial)
+        output = "".join(self.kept)
+        if len(self.laterValues) > 0 : output += "\n" + "\n".join(self.laterValues.values()) + "\n"
+        return output
+
+def loadEntryPoint(spec) :
+    moduleName, functionName = spec.rsplit(":", 1)
+    if moduleName.endswith(".py") :
+        name = os.path.splitext(os.path.basename(moduleName))[0]
+        module = imp.load_source(name, moduleName)
+    else :
+        sys.path.insert(0, os.getcwd())
+        module = __import__(moduleName, fromlist=[functionName])
+    return getattr(module, functionName)
+
+def readExactly(inputFile, n) :
+    data = inputFile.read(n)
+    if len(data) < n : return None
+    return data
+
+def runScript(entryPoint, script, maxOutputBytes) :
+    status = 0
+    captured = CappedOutput(maxOutputBytes)
+    sys.stdout = captured
+    try :
+        for command in script.split("\n") :
+            if len(command.strip()) == 0 : continue
+            try :
+                returned = entryPoint(command)
+                if isinstance(returned, dict) :
+                    for key in sorted(returned) : print "%s:=%s" % (key, returned[key])
+                elif returned is not None : print returned
+            except Exception :
+                traceback.print_exc(file=sys.stderr)
+                status = 1
+    finally :
+        sys.stdout = sys.__stdout__
+    return status, captured.getvalue(), captured.truncated
+
+def main() :
+    if len(sys.argv) < 2 :
+        print >>sys.stderr, "USAGE: %s <module>:<function> [<maxOutputBytes>]" % sys.argv[0]
+        sys.exit(2)
+    # Requests and replies go over the original stdin and stdout.  The target gets /dev/null
+    #   for both, so that anything it reads or writes directly (from C code, or a child
+    #   process) can't get mixed up with them.
+    requests = os.fdopen(os.dup(0), "rb")
+    replies = os.fdopen(os.dup(1), "wb")
+    nullInput = os.open(os.devnull, os.O_RDONLY)
+    nullOutput = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(nullInput, 0)
+    os.dup2(nullOutput, 1)
+    os.close(nullInput)
+    os.close(nullOutput)
+    entryPoint = loadEntryPoint(sys.argv[1])
+    maxOutputBytes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    while True :
+        header = readExactly(requests, 4)
+        if header is None : break
+        script = readExactly(requests, struct.unpack("!I", header)[0])
+        if script is None : break
+        status, output, truncated = runScript(entryPoint, script, maxOutputBytes)
+        replies.write(struct.pack("!iBI", status, truncated, len(output)) + output)
+        replies.flush()
+
+if __name__=="__main__" : main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# Looks up trials in an archive written by "##stringparam archiveDir ...": shows a trial's
+#   script and output values, and the trials it descends from, and can run its script again.
+#   It can also rebuild the trial from its plan file, the campaign seed and its lineage, to
+#   check that the trial is reproducible.
+#
+# USAGE: replay_fuzzplan.py <archive_dir>                     (how many trials there are)
+#        replay_fuzzplan.py <archive_dir> <trial> [--lineage] [--run] [--rebuild <plan_file>]
+import sys, subprocess
+import fuzzplan
+
+def showTrial(record) :
+    print "======== TRIAL %d (parent %s, exit status %s, ran for %.3fs)" % (record["trial"], record["parent"], record["status"],
+                                                                         record.get("runTime", 0.0))
+    print "======== script:"
+    sys.stdout.write(record["script"])
+    print "======== output values:"
+    for key in sorted(record["outputValues"]) : print "%s:=%s" % (key, record["outputValues"][key])
+
+def collectSteps(archive, record) :
+    # Every mutation from the first sequence of the campaign to this trial
+    pieces = list()
+    while True :
+        pieces.append(record["steps"])
+        if record["parent"] is None : break
+        record = archive.read(record["parent"])
+    return [step for piece in reversed(pieces) for step in piece]
+
+def rebuild(archive, record, planFilePath) :
+    plan = fuzzplan.Fuzzplan(planFilePath)
+    plan.parameters["seed"] = record["seed"]
+    plan.bindSubstitutionPoints() # again, now that the plan has a seed
+    donors = dict() # trial number -> rebuilt sequence, for mutations that spliced in another trial
+    def getDonor(iTrial) :
+        if iTrial not in donors : donors[iTrial] = plan.rebuildSequence(collectSteps(archive, archive.read(iTrial)), getDonor)
+        return donors[iTrial]
+    script = plan.rebuildSequence(collectSteps(archive, record), getDonor).render()
+    if script == record["script"] : print "======== rebuilt trial %d from seed %s; it matches" % (record["trial"], record["seed"])
+    else :
+        print "======== rebuilt trial %d from seed %s, but it DOESN'T match:" % (record["trial"], record["seed"])
+        sys.stdout.write(script)
+        print "======== (was the plan file changed, or did the run have no seed, and so use value pools?)"
+    plan.close()
+
+def main() :
+    if len(sys.argv) < 2 :
+        print "USAGE: %s <archive_dir> [<trial> [--lineage] [--run] [--rebuild <plan_file>]]" % sys.argv[0]
+        sys.exit(0)
+    archive = fuzzplan.TrialArchive(sys.argv[1])
+    if len(sys.argv) < 3 :
+        print "%d trials" % len(archive)
+        return
+    record = archive.read(int(sys.argv[2]))
+    showTrial(record)
+    if "--lineage" in sys.argv[3:] :
+        while record["parent"] is not None :
+            record = archive.read(record["parent"])
+            showTrial(record)
+    if "--rebuild" in sys.argv[3:-1] :
+        rebuild(archive, archive.read(int(sys.argv[2])), sys.argv[sys.argv.index("--rebuild") + 1])
+    if "--run" in sys.argv[3:] :
+        record = archive.read(int(sys.argv[2]))
+        print "======== rerunning trial %d" % record["trial"]
+        sys.stdout.flush()
+        subprocess.call(["/bin/sh", "-c", record["script"]])
+    archive.close()
+
+if __name__=="__main__" : main()
@@ -1,9 +1,10 @@
 import random
 
+# REMEMBER: make random choices with params["rng"], so that trials can be rebuilt from the seed.
 # REMEMBER: parameters set by the user could come in as strings,
 #   so please convert them to the type that you expect.
 
 def dummy_random(params) :
     chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-    return "".join([random.choice(chars) for I in range(int(params["len"]))])
+    return "".join([params["rng"].choice(chars) for I in range(int(params["len"]))])
 